@@ -0,0 +1,230 @@
+import time
+import asyncio
+import logging
+import threading
+import config
+
+logger = logging.getLogger("Bandwidth")
+
+# Priority classes. While both are active, BULK jobs get only `bulk_share` of the
+# global limit and INTERACTIVE jobs get the rest; a class running alone gets it all.
+# Without a global limit there is nothing to divide, so priorities have no effect.
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+class ByteBucket:
+    """
+    Token bucket on bytes. `reserve(n)` takes n bytes immediately (the balance may
+    go negative) and returns how long the caller must wait to stay within the rate.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate=0, burst_seconds=1.0):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self._tokens = rate * burst_seconds
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.rate * self.burst_seconds, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def reserve(self, n):
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill(time.monotonic())
+            self._tokens -= n
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+class JobThrottle:
+    """Per-job handle; engines call `consume(n)` (threads) or `await consume_async(n)` after moving n bytes."""
+
+    def __init__(self, manager, priority, job_rate):
+        self.manager = manager
+        self.priority = priority
+        self.bucket = ByteBucket(job_rate)
+
+    def _reserve(self, n):
+        return max(self.bucket.reserve(n), self.manager.classes[self.priority].reserve(n))
+
+    def consume(self, n):
+        delay = self._reserve(n)
+        if delay:
+            time.sleep(delay)
+
+    async def consume_async(self, n):
+        delay = self._reserve(n)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def close(self):
+        self.manager.unregister(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _check_share(bulk_share):
+    # Both classes need a non-zero share of the global limit: a bucket rate of 0
+    # means unlimited, so 0 or 1 would lift the limit for one class instead
+    if not 0 < bulk_share < 1:
+        raise ValueError("bulk_share must be between 0 and 1 (exclusive)")
+    return bulk_share
+
+class BandwidthManager:
+    """Global and per-job byte-rate limits for one direction (downloads or uploads)."""
+
+    def __init__(self, name, global_rate=0, job_rate=0, bulk_share=0.2):
+        _check_share(bulk_share)
+        self.name = name
+        self.global_rate = global_rate
+        self.job_rate = job_rate
+        self.bulk_share = bulk_share
+        self.classes = {INTERACTIVE: ByteBucket(), BULK: ByteBucket()}
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._rebalance()
+
+    def _rebalance(self):
+        active = {job.priority for job in self._jobs}
+        if INTERACTIVE in active and BULK in active:
+            bulk = self.global_rate * self.bulk_share
+            self.classes[BULK].set_rate(bulk)
+            self.classes[INTERACTIVE].set_rate(self.global_rate - bulk)
+        else:
+            for bucket in self.classes.values():
+                bucket.set_rate(self.global_rate)
+
+    def register(self, priority):
+        """Start shaping a job. Use as a context manager or call `close()` when done."""
+        throttle = JobThrottle(self, priority, self.job_rate)
+        with self._lock:
+            self._jobs.append(throttle)
+            self._rebalance()
+        return throttle
+
+    def unregister(self, throttle):
+        with self._lock:
+            if throttle in self._jobs:
+                self._jobs.remove(throttle)
+                self._rebalance()
+
+    def configure(self, global_rate=None, job_rate=None, bulk_share=None):
+        with self._lock:
+            if global_rate is not None:
+                self.global_rate = global_rate
+            if job_rate is not None:
+                self.job_rate = job_rate
+                for job in self._jobs:
+                    job.bucket.set_rate(job_rate)
+            if bulk_share is not None:
+                self.bulk_share = _check_share(bulk_share)
+            self._rebalance()
+
+    def status(self):
+        with self._lock:
+            counts = {p: sum(1 for j in self._jobs if j.priority == p) for p in self.classes}
+            return {
+                'global_kbps': self.global_rate / 1024,
+                'job_kbps': self.job_rate / 1024,
+                'bulk_share': self.bulk_share,
+                'interactive_jobs': counts[INTERACTIVE],
+                'bulk_jobs': counts[BULK],
+            }
+
+downloads = BandwidthManager(
+    "download", config.DOWNLOAD_LIMIT_KBPS * 1024, config.JOB_LIMIT_KBPS * 1024, config.BULK_SHARE
+)
+uploads = BandwidthManager(
+    "upload", config.UPLOAD_LIMIT_KBPS * 1024, config.JOB_LIMIT_KBPS * 1024, config.BULK_SHARE
+)
+
+def configure_from_args(args):
+    """
+    Apply `/bandwidth key=value ...` arguments (download, upload, job in KB/s,
+    0 = unlimited; bulk_share strictly between 0 and 1). Raises ValueError on bad input.
+    """
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        if not sep:
+            raise ValueError(f"Expected key=value, got '{arg}'")
+        number = float(value)
+        if number < 0:
+            raise ValueError(f"{key} must not be negative")
+        if key == 'download':
+            downloads.configure(global_rate=number * 1024)
+        elif key == 'upload':
+            uploads.configure(global_rate=number * 1024)
+        elif key == 'job':
+            downloads.configure(job_rate=number * 1024)
+            uploads.configure(job_rate=number * 1024)
+        elif key == 'bulk_share':
+            _check_share(number)
+            downloads.configure(bulk_share=number)
+            uploads.configure(bulk_share=number)
+        else:
+            raise ValueError(f"Unknown setting '{key}'")
+        logger.info(f"Bandwidth setting changed: {key}={value}")
+
+def settings():
+    """Current limits in `/bandwidth` units, as shared with workers through the broker."""
+    return {
+        'download': downloads.global_rate / 1024,
+        'upload': uploads.global_rate / 1024,
+        'job': downloads.job_rate / 1024,
+        'bulk_share': downloads.bulk_share,
+    }
+
+def publish(broker):
+    """Share this process's limits with the workers (front-end, at startup and after /bandwidth)."""
+    broker.put_setting('bandwidth', settings())
+
+def sync(broker, worker_id):
+    """
+    Worker side of `publish`: check in and apply the front-end's limits. The global
+    download limit is split evenly between live workers so that together they
+    stay within it. Until the front-end publishes, the worker's own config applies.
+    """
+    broker.check_in(worker_id)
+    shared = broker.get_setting('bandwidth')
+    if not shared:
+        return
+    workers = max(1, broker.live_workers())
+    download = shared['download'] * 1024 / workers
+    if download != downloads.global_rate or shared['job'] * 1024 != downloads.job_rate \
+            or shared['bulk_share'] != downloads.bulk_share:
+        logger.info(f"Applying shared bandwidth limits: {shared} ({workers} live workers)")
+    downloads.configure(global_rate=download, job_rate=shared['job'] * 1024, bulk_share=shared['bulk_share'])
+    uploads.configure(global_rate=shared['upload'] * 1024, job_rate=shared['job'] * 1024,
+                      bulk_share=shared['bulk_share'])
+
+def format_status(workers=None):
+    """
+    Render both directions' limits and active jobs as a chat message. `workers` is
+    the number of live download workers when downloads run in separate processes.
+    """
+    def limit(kbps):
+        return f"{kbps:.0f} KB/s" if kbps else "unlimited"
+    msg = "📶 Bandwidth:\n\n"
+    for manager in (downloads, uploads):
+        s = manager.status()
+        msg += (
+            f"{manager.name}: {limit(s['global_kbps'])} (per job: {limit(s['job_kbps'])}, "
+            f"bulk share: {s['bulk_share']:.0%})\n"
+            f"   active: {s['interactive_jobs']} interactive, {s['bulk_jobs']} bulk\n"
+        )
+    if workers is not None:
+        msg += f"\nDownloads run on {workers} live worker(s), which split the download limit; active counts are for uploads in this process.\n"
+    if not downloads.global_rate and not uploads.global_rate:
+        msg += "\nBulk jobs only yield to single downloads under a global limit.\n"
+    msg += "\nChange with /bandwidth download=KBPS upload=KBPS job=KBPS bulk_share=0.2"
+    return msg
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from main import TencentMeetingDownloader, SESSION_HEADERS
+import tracing
+import bandwidth
+import config
+
+logger = logging.getLogger("TencentBatch")
+
+def read_urls(path):
+    """Read one URL per line, skipping blank lines and `#` comments."""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+def _pooled_session(pool_size):
+    # Shared by every job thread, so its headers are set here once and never changed
+    session = requests.Session()
+    session.headers.update(SESSION_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def run_batch(urls, jobs=4, out_dir='.', cookie=None, report_path=None, download_all=True):
+    """
+    Download every URL in `urls` with `jobs` concurrent downloads, each into
+    <out_dir>/<short_id>/.
+    URLs are deduplicated by URL and by short_id, all jobs share one connection
+    pool and one metadata cache, and a JSONL line per URL is written to
+    `report_path` (default: <out_dir>/batch_report.jsonl).
+    Returns the list of report records.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    report_path = report_path or os.path.join(out_dir, 'batch_report.jsonl')
+
+    api_session = _pooled_session(jobs)
+    transfer_session = _pooled_session(jobs * max(2, config.DOWNLOAD_CONNECTIONS))
+    metadata_cache = {}
+    # Cookies are parsed once onto the shared API session
+    parser = TencentMeetingDownloader(cookie, session=api_session)
+
+    records = []
+    queue = []
+    seen_urls = set()
+    seen_short_ids = set()
+    for url in urls:
+        record = {'url': url, 'short_id': None, 'status': None, 'files': [], 'bytes': 0, 'error': None}
+        try:
+            record['short_id'] = parser.extract_short_id(url)
+        except ValueError as e:
+            record.update(status='invalid', error=str(e))
+            records.append(record)
+            continue
+        if url in seen_urls or record['short_id'] in seen_short_ids:
+            record['status'] = 'duplicate'
+            records.append(record)
+            continue
+        seen_urls.add(url)
+        seen_short_ids.add(record['short_id'])
+        queue.append(record)
+
+    bar = tqdm(unit='B', unit_scale=True, desc=f"0/{len(queue)} done")
+    bar_lock = threading.Lock()
+    done = 0
+
+    def on_progress(event):
+        if event.get('bytes'):
+            with bar_lock:
+                bar.update(event['bytes'])
+
+    def process(record):
+        downloader = TencentMeetingDownloader(
+            session=api_session, transfer_session=transfer_session, metadata_cache=metadata_cache
+        )
+        record['started_at'] = time.time()
+        start = time.monotonic()
+        # File names come from meeting topics, which recur across URLs (recurring meetings);
+        # a directory per short_id keeps concurrent jobs from writing the same path
+        job_dir = os.path.join(out_dir, record['short_id'])
+        try:
+            os.makedirs(job_dir, exist_ok=True)
+            with tracing.job_trace(record['short_id']), tracing.span("job", url=record['url']), \
+                    bandwidth.downloads.register(bandwidth.BULK) as throttle:
+                files = downloader.download_all(
+                    record['url'], max_count=None if download_all else 1,
+                    output_dir=job_dir, progress_callback=on_progress, quiet=True, throttle=throttle,
+                    write_manifest=True,
+                )
+            record['files'] = files
+            record['bytes'] = sum(os.path.getsize(f) for f in files if os.path.exists(f))
+            record['status'] = 'ok' if files else 'failed'
+        except Exception as e:
+            record.update(status='failed', error=str(e))
+        record['elapsed'] = round(time.monotonic() - start, 2)
+        return record
+
+    with open(report_path, 'a', encoding='utf-8') as report:
+        for record in records:
+            report.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(process, record) for record in queue]
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                report.write(json.dumps(record, ensure_ascii=False) + '\n')
+                report.flush()
+                done += 1
+                with bar_lock:
+                    bar.set_description(f"{done}/{len(queue)} done")
+    bar.close()
+
+    ok = sum(1 for r in records if r['status'] == 'ok')
+    logger.info(f"Batch finished: {ok}/{len(records)} succeeded, report written to {report_path}")
+    return records
@@ -1,3 +1,4 @@
+import startup
 import logging
 import config
 
@@ -13,6 +14,9 @@ def main():
     if config.RUN_MODE == "CLIENT":
         import client_mode
         client_mode.run()
+    elif config.RUN_MODE == "WORKER":
+        import worker
+        worker.run()
     else:
         import bot_mode
         bot_mode.run()
@@ -1,16 +1,33 @@
 import os
 import logging
 import asyncio
+import functools
 import subprocess
 import glob
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from main import TencentMeetingDownloader
+from cookie_pool import CookiePool, format_status, publish as publish_cookies
+import rate_limiter
+from progress import ProgressTracker, report_progress
+import tracing
+import bandwidth
+from broker import get_broker, RemoteJobs
+from job_store import JobStore, only_ids, QUEUED, DOWNLOADING, UPLOADING, DONE, FAILED
+from watcher import CollectionWatcher, format_watches
+import startup
 import config
 
 # --- LOGGING ---
 logger = logging.getLogger("TencentBotMode")
-current_cookie = config.DEFAULT_COOKIE
+cookie_pool = CookiePool(config.COOKIE_POOL)
+job_store = JobStore(config.JOB_DB_PATH)
+os.makedirs(config.DOWNLOAD_DIR, exist_ok=True)
+# Set when QUEUE_BACKEND hands downloads to separate worker processes
+_broker = get_broker()
+remote_jobs = RemoteJobs(_broker) if _broker else None
+# Created in _resume_jobs once the application (and its bot) exists
+watcher = None
 
 async def split_video(filename, chunk_size_mb=49):
     """
@@ -28,20 +45,127 @@ async def split_video(filename, chunk_size_mb=49):
     chunks = sorted(glob.glob(f"{base}_part*{ext}"))
     return chunks
 
+async def track_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    startup.mark_first_message()
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "🤖 Bot Mode Active!\n\n"
         "Send me a Tencent Meeting URL. If it's >50MB, I will split it for you automatically."
     )
 
+async def _share_cookies():
+    # Workers download with the front-end's cookie pool
+    if _broker:
+        await asyncio.get_event_loop().run_in_executor(None, publish_cookies, cookie_pool, _broker)
+
+async def _require_admin(update: Update, action):
+    """Reply and return False unless the sender is in TG_ADMIN_IDS."""
+    if update.effective_user.id in config.TG_ADMIN_IDS:
+        return True
+    await update.message.reply_text(f"❌ Only admins (TG_ADMIN_IDS) can {action}.")
+    return False
+
 async def set_cookie(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global current_cookie
+    if not await _require_admin(update, "change cookies"):
+        return
     if not context.args:
         await update.message.reply_text("Usage: /set_cookie <cookie_string>")
         return
-    current_cookie = " ".join(context.args)
+    cookie_pool.replace(" ".join(context.args))
+    await _share_cookies()
     await update.message.reply_text("✅ Cookie updated!")
 
+async def add_cookie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _require_admin(update, "change cookies"):
+        return
+    if not context.args:
+        await update.message.reply_text("Usage: /add_cookie <cookie_string>")
+        return
+    if cookie_pool.add(" ".join(context.args)):
+        await _share_cookies()
+        await update.message.reply_text(f"✅ Cookie added! Pool size: {len(cookie_pool)}")
+    else:
+        await update.message.reply_text("⚠️ Cookie is already in the pool.")
+
+async def remove_cookie(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _require_admin(update, "change cookies"):
+        return
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /remove_cookie <index> (see /cookies)")
+        return
+    if cookie_pool.remove(int(context.args[0])):
+        await _share_cookies()
+        await update.message.reply_text(f"✅ Cookie removed! Pool size: {len(cookie_pool)}")
+    else:
+        await update.message.reply_text("❌ No cookie with that index.")
+
+async def list_cookies(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _require_admin(update, "view cookies"):
+        return
+    await update.message.reply_text(format_status(cookie_pool))
+
+async def api_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(rate_limiter.format_stats())
+
+async def watch_collection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Usage: /watch <URL>")
+        return
+    url = context.args[0]
+    status_msg = await update.message.reply_text("🔍 Checking collection...")
+    try:
+        watch_id, count = await watcher.add(url, update.effective_chat.id)
+    except Exception as e:
+        await status_msg.edit_text(f"❌ Error: {str(e)}")
+        return
+    if watch_id is None:
+        await status_msg.edit_text("⚠️ This collection is already watched (see /watches).")
+    else:
+        await status_msg.edit_text(
+            f"👀 Watching collection {watch_id} ({count} existing recording(s)).\n"
+            "New recordings will be downloaded automatically. Stop with /unwatch " + str(watch_id)
+        )
+
+async def unwatch_collection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /unwatch <id> (see /watches)")
+        return
+    if job_store.remove_watch(int(context.args[0]), update.effective_chat.id):
+        await update.message.reply_text("✅ Stopped watching.")
+    else:
+        await update.message.reply_text("❌ No watch with that id.")
+
+async def list_watches(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(format_watches(job_store.list_watches(update.effective_chat.id)))
+
+async def set_bandwidth(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    loop = asyncio.get_event_loop()
+    if context.args:
+        if not await _require_admin(update, "change bandwidth limits"):
+            return
+        try:
+            bandwidth.configure_from_args(context.args)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+        if _broker:
+            await loop.run_in_executor(None, bandwidth.publish, _broker)
+    workers = await loop.run_in_executor(None, _broker.live_workers) if _broker else None
+    await update.message.reply_text(bandwidth.format_status(workers))
+
+async def trace_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /trace <job_id>")
+        return
+    if not config.TRACE_FILE:
+        await update.message.reply_text("Tracing is disabled. Set TRACE_FILE to enable it.")
+        return
+    # Reading the trace file can take a while; keep it off the event loop
+    loop = asyncio.get_event_loop()
+    summary = await loop.run_in_executor(None, tracing.summarize_job, context.args[0])
+    await update.message.reply_text(summary)
+
 async def list_recordings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List available recordings without downloading."""
     if not context.args:
@@ -52,7 +176,7 @@ async def list_recordings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status_msg = await update.message.reply_text("🔍 Fetching recording list...")
 
     try:
-        downloader = TencentMeetingDownloader(current_cookie)
+        downloader = TencentMeetingDownloader(cookie_pool=cookie_pool)
         loop = asyncio.get_event_loop()
         recordings = await loop.run_in_executor(None, downloader.get_recording_list, url)
 
@@ -82,85 +206,179 @@ async def download_all_recordings(update: Update, context: ContextTypes.DEFAULT_
         return
 
     url = context.args[0]
-    await _process_download(update, url, download_all=True)
+    await _process_download(context.bot, update.effective_chat.id, url, download_all=True)
 
-async def _send_video_file(update, local_filename, status_msg):
-    """Send a video file, splitting if necessary."""
+async def _send_video_file(bot, chat_id, local_filename, status_msg, throttle=None):
+    """
+    Send a video file, splitting if necessary.
+    PTB reads each file in one go, so `throttle` is charged per file (or part) before sending:
+    the upload limit spaces out files rather than slowing each one down.
+    """
     file_size_mb = os.path.getsize(local_filename) / (1024 * 1024)
 
     if file_size_mb > 50:
         await status_msg.edit_text(f"📦 Large file ({file_size_mb:.1f}MB). Splitting...")
-        chunks = await split_video(local_filename)
+        with tracing.span("split", file=os.path.basename(local_filename), bytes=os.path.getsize(local_filename)) as split_span:
+            chunks = await split_video(local_filename)
+            split_span.set(chunks=len(chunks))
 
         for i, chunk in enumerate(chunks):
-            with open(chunk, 'rb') as video:
-                await update.message.reply_video(
+            if throttle:
+                await throttle.consume_async(os.path.getsize(chunk))
+            with open(chunk, 'rb') as video, tracing.span("upload", file=os.path.basename(chunk),
+                                                          bytes=os.path.getsize(chunk)):
+                await bot.send_video(
+                    chat_id=chat_id,
                     video=video,
-                    caption=f"✅ {local_filename} (Part {i+1}/{len(chunks)})",
+                    caption=f"✅ {os.path.basename(local_filename)} (Part {i+1}/{len(chunks)})",
                     supports_streaming=True
                 )
             os.remove(chunk)
     else:
-        with open(local_filename, 'rb') as video:
-            await update.message.reply_video(
+        if throttle:
+            await throttle.consume_async(os.path.getsize(local_filename))
+        with open(local_filename, 'rb') as video, tracing.span("upload", file=os.path.basename(local_filename),
+                                                               bytes=os.path.getsize(local_filename)):
+            await bot.send_video(
+                chat_id=chat_id,
                 video=video,
-                caption=f"✅ {local_filename}",
+                caption=f"✅ {os.path.basename(local_filename)}",
                 supports_streaming=True
             )
 
     os.remove(local_filename)
 
-async def _process_download(update, url, download_all=False):
-    """Process download for a URL."""
-    status_msg = await update.message.reply_text("🔍 Analyzing (Bot Mode)...")
-
-    try:
-        downloader = TencentMeetingDownloader(current_cookie)
-        loop = asyncio.get_event_loop()
+async def _process_download(bot, chat_id, url, download_all=False, job_id=None, only=None):
+    """
+    Process download for a URL.
+    Progress is recorded in the job store; pass `job_id` to resume an interrupted job.
+    `only` limits a new job to the given recording keys (see main.recording_key).
+    """
+    if job_id is None:
+        job_id = job_store.create_job(url, chat_id, download_all, only)
+        status_msg = await bot.send_message(chat_id, f"🔍 Analyzing (Bot Mode)... [job {job_id}]")
+    else:
+        status_msg = await bot.send_message(chat_id, f"♻️ Resuming interrupted download... [job {job_id}]")
 
-        if download_all:
-            await status_msg.edit_text("⏳ Downloading all recordings...")
-            filenames = await loop.run_in_executor(None, downloader.download_all, url)
+    priority = bandwidth.BULK if download_all else bandwidth.INTERACTIVE
+    with tracing.job_trace(job_id), tracing.span("job", url=url, download_all=download_all):
+        try:
+            job = job_store.get_job(job_id)
+            only = only_ids(job)
+            if job['stage'] in (QUEUED, DOWNLOADING):
+                job_store.set_stage(job_id, DOWNLOADING)
+                if remote_jobs:
+                    await status_msg.edit_text("⏳ Queued for a download worker...")
+                    await remote_jobs.run(
+                        {'job_id': job_id, 'url': url, 'download_all': download_all,
+                         'skip': sorted(job_store.completed_indices(job_id)),
+                         'only': sorted(only) if only is not None else None},
+                        edit=status_msg.edit_text,
+                        on_file=lambda idx, filename, key: job_store.add_file(job_id, idx, filename, key),
+                    )
+                else:
+                    await status_msg.edit_text("⏳ Downloading all recordings..." if download_all else "⏳ Downloading...")
+                    downloader = TencentMeetingDownloader(cookie_pool=cookie_pool)
+                    loop = asyncio.get_event_loop()
+                    tracker = ProgressTracker()
+                    reporter = asyncio.create_task(report_progress(tracker, status_msg.edit_text, config.PROGRESS_INTERVAL))
+                    throttle = bandwidth.downloads.register(priority)
+                    try:
+                        await loop.run_in_executor(None, tracing.bind(functools.partial(
+                            downloader.download_all, url,
+                            max_count=None if download_all else 1,
+                            progress_callback=tracker,
+                            output_dir=config.DOWNLOAD_DIR,
+                            skip=job_store.completed_indices(job_id),
+                            on_file=lambda idx, filename, key: job_store.add_file(job_id, idx, filename, key),
+                            throttle=throttle,
+                            only=only,
+                        )))
+                    finally:
+                        reporter.cancel()
+                        throttle.close()
 
+            filenames = job_store.pending_uploads(job_id)
             if filenames:
-                await status_msg.edit_text(f"📤 Uploading {len(filenames)} file(s)...")
-                for filename in filenames:
-                    if os.path.exists(filename):
-                        await _send_video_file(update, filename, status_msg)
+                job_store.set_stage(job_id, UPLOADING)
+                if len(filenames) > 1:
+                    await status_msg.edit_text(f"📤 Uploading {len(filenames)} file(s)...")
+                with bandwidth.uploads.register(priority) as throttle:
+                    for filename in filenames:
+                        await _send_video_file(bot, chat_id, filename, status_msg, throttle)
+                        job_store.mark_uploaded(job_id, filename)
                 await status_msg.delete()
-            else:
-                await status_msg.edit_text("❌ No files downloaded.")
-        else:
-            await status_msg.edit_text("⏳ Downloading...")
-            local_filename = await loop.run_in_executor(None, downloader.start_download, url)
-
-            if local_filename and os.path.exists(local_filename):
-                await _send_video_file(update, local_filename, status_msg)
+                job_store.set_stage(job_id, DONE)
+            elif job_store.get_files(job_id):
+                # Everything was already uploaded before the restart
                 await status_msg.delete()
+                job_store.set_stage(job_id, DONE)
             else:
-                await status_msg.edit_text("❌ Download failed.")
+                await status_msg.edit_text("❌ No files downloaded." if download_all else "❌ Download failed.")
+                job_store.set_stage(job_id, FAILED, "No files downloaded")
 
-    except Exception as e:
-        logger.exception("Error in Bot Mode")
-        await status_msg.edit_text(f"❌ Error: {str(e)}")
+        except Exception as e:
+            logger.exception("Error in Bot Mode")
+            job_store.set_stage(job_id, FAILED, str(e))
+            await status_msg.edit_text(f"❌ Error: {str(e)}")
+
+async def _resume_jobs(app):
+    """Re-enqueue jobs that were queued or in progress when the bot last stopped."""
+    global watcher
+    if remote_jobs:
+        # Workers take their limits and cookies from the front-end
+        bandwidth.publish(_broker)
+        publish_cookies(cookie_pool, _broker)
+        app.create_task(remote_jobs.pump())
+
+    async def start_watch_job(watch, keys):
+        await app.bot.send_message(watch['chat_id'], f"🆕 {len(keys)} new recording(s) in watched collection {watch['id']}")
+        await _process_download(app.bot, watch['chat_id'], watch['url'], download_all=True, only=keys)
+
+    watcher = CollectionWatcher(job_store, start_watch_job, cookie_pool)
+    app.create_task(watcher.run())
+    for job in job_store.unfinished_jobs():
+        logger.info(f"Resuming job {job['id']} ({job['stage']}): {job['url']}")
+        app.create_task(_process_download(
+            app.bot, job['chat_id'], job['url'], bool(job['download_all']), job_id=job['id']
+        ))
 
 async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     url = update.message.text
     if "meeting.tencent.com" not in url:
         return
 
-    await _process_download(update, url, download_all=False)
+    await _process_download(context.bot, update.effective_chat.id, url, download_all=False)
 
 def run():
     if not config.TELEGRAM_TOKEN:
         print("ERROR: No TELEGRAM_TOKEN found in config.py")
         return
 
-    app = ApplicationBuilder().token(config.TELEGRAM_TOKEN).build()
+    # Download handlers await their job (in-process or on a worker) until it finishes, so
+    # updates must be handled concurrently: otherwise one download blocks every other
+    # job and command, including single URLs meant to preempt bulk jobs and /bandwidth
+    app = (
+        ApplicationBuilder().token(config.TELEGRAM_TOKEN)
+        .concurrent_updates(True)
+        .post_init(_resume_jobs)
+        .build()
+    )
+    # Runs before the regular handlers (group -1) without consuming the update
+    app.add_handler(TypeHandler(Update, track_first_update), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("set_cookie", set_cookie))
+    app.add_handler(CommandHandler("add_cookie", add_cookie))
+    app.add_handler(CommandHandler("remove_cookie", remove_cookie))
+    app.add_handler(CommandHandler("cookies", list_cookies))
+    app.add_handler(CommandHandler("api_stats", api_stats))
+    app.add_handler(CommandHandler("bandwidth", set_bandwidth))
+    app.add_handler(CommandHandler("trace", trace_job))
     app.add_handler(CommandHandler("list", list_recordings))
     app.add_handler(CommandHandler("download_all", download_all_recordings))
+    app.add_handler(CommandHandler("watch", watch_collection))
+    app.add_handler(CommandHandler("unwatch", unwatch_collection))
+    app.add_handler(CommandHandler("watches", list_watches))
     app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_url))
 
     print("Bot Mode is starting...")
@@ -0,0 +1,397 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+import config
+
+logger = logging.getLogger("Broker")
+
+# Job payloads look like {'job_id': 1, 'url': ..., 'download_all': False, 'skip': [0, 2], 'only': None}
+# ('only' is a list of recording keys to limit the job to, see main.recording_key).
+# Workers report back with events:
+#   {'type': 'progress', 'text': ...}          status-message text, already coalesced
+#   {'type': 'file', 'idx': 0, 'filename': ..., 'recording': <key>}  a recording finished downloading
+#   {'type': 'done'} / {'type': 'failed', 'error': ...}
+# A finished job stays behind as a tombstone until the front-end has read its
+# events and calls ack(), so that resuming it after a front-end restart waits for
+# those events instead of queueing (and downloading) it a second time.
+# The front-end also shares settings with the workers (e.g. 'bandwidth', see
+# bandwidth.publish), and workers check in so that limits can be split between them.
+
+# A worker that hasn't checked in for this long no longer counts as live
+WORKER_TTL = 60
+
+class SQLiteBroker:
+    """
+    Job queue in a local SQLite database (WAL mode) shared by the front-end and
+    the workers through a volume. Claims expire after `lease_timeout` seconds
+    without a heartbeat, so jobs of a crashed worker go back to the queue.
+    """
+
+    def __init__(self, path, lease_timeout=600):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lease_timeout = lease_timeout
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS queue (
+                job_id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                heartbeat REAL
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                worker TEXT PRIMARY KEY,
+                seen REAL NOT NULL
+            );
+        """)
+
+    def enqueue(self, job):
+        """Queue a job. Returns False if it is already queued, being worked on, or finished but not acked."""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM queue WHERE job_id = ?", (job['job_id'],)).fetchone()
+            if row:
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO queue (job_id, payload, status) VALUES (?, ?, 'pending')",
+                (job['job_id'], json.dumps(job)),
+            )
+        return True
+
+    def recover(self, worker_id):
+        """Put jobs claimed by a previous run of `worker_id` back in the queue."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE queue SET status = 'pending', worker = NULL WHERE status = 'claimed' AND worker = ?",
+                (worker_id,),
+            )
+
+    def claim(self, worker_id):
+        """Take the oldest pending job, or None if the queue is empty."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE queue SET status = 'pending', worker = NULL WHERE status = 'claimed' AND heartbeat < ?",
+                    (time.time() - self.lease_timeout,),
+                )
+                row = self._conn.execute(
+                    "SELECT job_id, payload FROM queue WHERE status = 'pending' ORDER BY job_id LIMIT 1"
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE queue SET status = 'claimed', worker = ?, heartbeat = ? WHERE job_id = ?",
+                        (worker_id, time.time(), row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row:
+            time.sleep(1)
+            return None
+        return json.loads(row[1])
+
+    def heartbeat(self, job_id):
+        with self._lock:
+            self._conn.execute("UPDATE queue SET heartbeat = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def state(self, job_id):
+        """
+        'pending', 'claimed', 'stale' (claimed, lease expired), 'done' (finished,
+        not acked yet) or None if the job is not in the queue.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT status, heartbeat FROM queue WHERE job_id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        if row[0] == 'claimed' and row[1] < time.time() - self.lease_timeout:
+            return 'stale'
+        return row[0]
+
+    def drop(self, job_id):
+        """Forget a job the front-end gave up on, so it is not run later and can be queued again."""
+        with self._lock:
+            self._conn.execute("DELETE FROM queue WHERE job_id = ?", (job_id,))
+
+    def ack(self, job_id):
+        """The front-end has handled the job's final event; remove its tombstone."""
+        with self._lock:
+            self._conn.execute("DELETE FROM queue WHERE job_id = ? AND status = 'done'", (job_id,))
+
+    def complete(self, job, worker_id):
+        with self._lock:
+            self._conn.execute("UPDATE queue SET status = 'done' WHERE job_id = ?", (job['job_id'],))
+
+    def publish(self, job_id, event):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO events (job_id, payload) VALUES (?, ?)", (job_id, json.dumps(event))
+            )
+
+    def fetch_events(self, limit=100):
+        """Remove and return up to `limit` pending events as (job_id, event) pairs."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, job_id, payload FROM events ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+            if rows:
+                self._conn.execute("DELETE FROM events WHERE seq <= ?", (rows[-1][0],))
+        return [(job_id, json.loads(payload)) for _, job_id, payload in rows]
+
+    def put_setting(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def get_setting(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def check_in(self, worker_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO workers (worker, seen) VALUES (?, ?)", (worker_id, time.time())
+            )
+
+    def live_workers(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE seen >= ?", (time.time() - WORKER_TTL,)
+            ).fetchone()
+        return row[0]
+
+class RedisBroker:
+    """
+    Job queue in Redis (any Redis-compatible server). Claimed jobs sit in a
+    per-worker processing list until completed. Like the SQLite claims, each
+    has a lease (a deadline in the LEASES sorted set) that heartbeats extend;
+    `claim` re-queues jobs whose lease expired, so the jobs of a worker that
+    died and never came back are picked up by the others.
+    """
+
+    QUEUE = "tmbot:queue"
+    ACTIVE = "tmbot:active"
+    EVENTS = "tmbot:events"
+    # job_id -> lease deadline, and job_id -> {'worker': ..., 'payload': ...} for re-queueing
+    LEASES = "tmbot:leases"
+    CLAIMS = "tmbot:claims"
+    # worker_id -> last check-in time
+    WORKERS = "tmbot:workers"
+    # Finished jobs not acked by the front-end yet; they also stay in ACTIVE
+    DONE = "tmbot:done"
+
+    def __init__(self, url, lease_timeout=600):
+        # Optional dependency, only needed for QUEUE_BACKEND=redis
+        import redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.lease_timeout = lease_timeout
+
+    def _processing(self, worker_id):
+        return f"tmbot:processing:{worker_id}"
+
+    def enqueue(self, job):
+        if not self._redis.sadd(self.ACTIVE, job['job_id']):
+            return False
+        self._redis.lpush(self.QUEUE, json.dumps(job))
+        return True
+
+    def _forget_claim(self, job_id):
+        """Remove a claim's lease and processing-list entry. Returns the claim, or None if already gone."""
+        claim = self._redis.hget(self.CLAIMS, job_id)
+        if not self._redis.zrem(self.LEASES, job_id) or not claim:
+            return None
+        claim = json.loads(claim)
+        pipe = self._redis.pipeline()
+        pipe.lrem(self._processing(claim['worker']), 1, claim['payload'])
+        pipe.hdel(self.CLAIMS, job_id)
+        pipe.execute()
+        return claim
+
+    def _reap(self):
+        for job_id in self._redis.zrangebyscore(self.LEASES, 0, time.time()):
+            # zrem in _forget_claim decides which of several reaping workers re-queues it
+            claim = self._forget_claim(job_id)
+            if claim:
+                logger.warning(f"Lease of job {job_id} on {claim['worker']} expired, re-queueing it")
+                # The consuming end, so it runs before newer jobs
+                self._redis.rpush(self.QUEUE, claim['payload'])
+
+    def recover(self, worker_id):
+        while True:
+            payload = self._redis.rpoplpush(self._processing(worker_id), self.QUEUE)
+            if not payload:
+                break
+            job_id = json.loads(payload)['job_id']
+            self._redis.zrem(self.LEASES, job_id)
+            self._redis.hdel(self.CLAIMS, job_id)
+
+    def claim(self, worker_id):
+        self._reap()
+        payload = self._redis.brpoplpush(self.QUEUE, self._processing(worker_id), timeout=1)
+        if not payload:
+            return None
+        job = json.loads(payload)
+        pipe = self._redis.pipeline()
+        pipe.hset(self.CLAIMS, job['job_id'], json.dumps({'worker': worker_id, 'payload': payload}))
+        pipe.zadd(self.LEASES, {job['job_id']: time.time() + self.lease_timeout})
+        pipe.execute()
+        return job
+
+    def heartbeat(self, job_id):
+        # xx: don't resurrect a lease that was reaped or completed
+        self._redis.zadd(self.LEASES, {job_id: time.time() + self.lease_timeout}, xx=True)
+
+    def state(self, job_id):
+        deadline = self._redis.zscore(self.LEASES, job_id)
+        if deadline is not None:
+            return 'stale' if deadline < time.time() else 'claimed'
+        if self._redis.sismember(self.DONE, job_id):
+            return 'done'
+        return 'pending' if self._redis.sismember(self.ACTIVE, job_id) else None
+
+    def drop(self, job_id):
+        self._forget_claim(job_id)
+        for payload in self._redis.lrange(self.QUEUE, 0, -1):
+            if json.loads(payload)['job_id'] == job_id:
+                self._redis.lrem(self.QUEUE, 1, payload)
+        self._redis.srem(self.DONE, job_id)
+        self._redis.srem(self.ACTIVE, job_id)
+
+    def ack(self, job_id):
+        if self._redis.srem(self.DONE, job_id):
+            self._redis.srem(self.ACTIVE, job_id)
+
+    def complete(self, job, worker_id):
+        pipe = self._redis.pipeline()
+        pipe.lrem(self._processing(worker_id), 1, json.dumps(job))
+        pipe.zrem(self.LEASES, job['job_id'])
+        pipe.hdel(self.CLAIMS, job['job_id'])
+        # Stays in ACTIVE (so enqueue refuses it) until the front-end acks it
+        pipe.sadd(self.DONE, job['job_id'])
+        pipe.execute()
+
+    def publish(self, job_id, event):
+        self._redis.rpush(self.EVENTS, json.dumps({'job_id': job_id, 'event': event}))
+
+    def fetch_events(self, limit=100):
+        pipe = self._redis.pipeline()
+        pipe.lrange(self.EVENTS, 0, limit - 1)
+        pipe.ltrim(self.EVENTS, limit, -1)
+        items, _ = pipe.execute()
+        return [(item['job_id'], item['event']) for item in map(json.loads, items)]
+
+    def put_setting(self, key, value):
+        self._redis.set(f"tmbot:settings:{key}", json.dumps(value))
+
+    def get_setting(self, key):
+        value = self._redis.get(f"tmbot:settings:{key}")
+        return json.loads(value) if value else None
+
+    def check_in(self, worker_id):
+        self._redis.zadd(self.WORKERS, {worker_id: time.time()})
+
+    def live_workers(self):
+        self._redis.zremrangebyscore(self.WORKERS, 0, time.time() - WORKER_TTL)
+        return self._redis.zcard(self.WORKERS)
+
+def get_broker():
+    """The broker selected by QUEUE_BACKEND, or None when downloads run in-process."""
+    backend = config.QUEUE_BACKEND.lower()
+    if not backend:
+        return None
+    if backend == "sqlite":
+        return SQLiteBroker(config.QUEUE_DB_PATH, lease_timeout=config.QUEUE_LEASE_TIMEOUT)
+    if backend == "redis":
+        return RedisBroker(config.REDIS_URL, lease_timeout=config.QUEUE_LEASE_TIMEOUT)
+    raise ValueError(f"Unknown QUEUE_BACKEND: {config.QUEUE_BACKEND}")
+
+def default_worker_id():
+    return config.WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+class RemoteJobs:
+    """
+    Front-end side of the queue: enqueues jobs and relays worker events back
+    to the coroutine waiting on each job. `pump()` must run as a background task.
+    """
+
+    def __init__(self, broker, poll_interval=1.0, stale_timeout=None):
+        self.broker = broker
+        self.poll_interval = poll_interval
+        # How long a job may go without events before its state is checked
+        self.stale_timeout = stale_timeout or getattr(broker, 'lease_timeout', 600)
+        self._queues = {}
+
+    def _queue(self, job_id):
+        return self._queues.setdefault(job_id, asyncio.Queue())
+
+    async def pump(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                events = await loop.run_in_executor(None, self.broker.fetch_events)
+            except Exception:
+                logger.exception("Failed to fetch worker events")
+                events = []
+            for job_id, event in events:
+                self._queue(job_id).put_nowait(event)
+            if not events:
+                await asyncio.sleep(self.poll_interval)
+
+    async def run(self, job, edit, on_file):
+        """
+        Enqueue `job` and wait for a worker to finish it. Progress text is passed
+        to `edit` (errors ignored), finished files to `on_file(idx, filename, key)`.
+        Raises if the worker reports a failure, or if the job went quiet for
+        `stale_timeout` and is neither queued nor held by a live worker.
+        """
+        loop = asyncio.get_event_loop()
+        queue = self._queue(job['job_id'])
+        if not await loop.run_in_executor(None, self.broker.enqueue, job):
+            logger.info(f"Job {job['job_id']} is already queued or finished, waiting for its events")
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.stale_timeout)
+                except asyncio.TimeoutError:
+                    # Waiting in the queue or running with heartbeats is fine; a job that
+                    # vanished, finished without its events reaching us, or whose lease
+                    # expired with no worker left to reap it is not
+                    state = await loop.run_in_executor(None, self.broker.state, job['job_id'])
+                    if state in ('pending', 'claimed'):
+                        continue
+                    await loop.run_in_executor(None, self.broker.drop, job['job_id'])
+                    raise Exception(f"Job {job['job_id']} stalled: no worker reported on it for {self.stale_timeout}s")
+                if event['type'] == 'progress':
+                    try:
+                        await edit(event['text'])
+                    except Exception as e:
+                        logger.debug(f"Progress edit failed: {e}")
+                elif event['type'] == 'file':
+                    on_file(event['idx'], event['filename'], event.get('recording'))
+                elif event['type'] == 'done':
+                    await loop.run_in_executor(None, self.broker.ack, job['job_id'])
+                    return
+                elif event['type'] == 'failed':
+                    await loop.run_in_executor(None, self.broker.ack, job['job_id'])
+                    raise Exception(event['error'])
+        finally:
+            self._queues.pop(job['job_id'], None)
@@ -1,15 +1,35 @@
 import os
 import logging
 import asyncio
+import functools
 import time
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 from main import TencentMeetingDownloader
+from cookie_pool import CookiePool, format_status, publish as publish_cookies
+import rate_limiter
+from progress import ProgressTracker, report_progress
+import tracing
+import bandwidth
+from broker import get_broker, RemoteJobs
+from job_store import JobStore, only_ids, QUEUED, DOWNLOADING, UPLOADING, DONE, FAILED
+from watcher import CollectionWatcher, format_watches
+import startup
 import config
 
 # --- LOGGING ---
 logger = logging.getLogger("TencentClientMode")
-current_cookie = config.DEFAULT_COOKIE
+cookie_pool = CookiePool(config.COOKIE_POOL)
+job_store = JobStore(config.JOB_DB_PATH)
+os.makedirs(config.DOWNLOAD_DIR, exist_ok=True)
+# Set when QUEUE_BACKEND hands downloads to separate worker processes
+_broker = get_broker()
+remote_jobs = RemoteJobs(_broker) if _broker else None
+
+async def _share_cookies():
+    # Workers download with the front-end's cookie pool
+    if _broker:
+        await asyncio.get_event_loop().run_in_executor(None, publish_cookies, cookie_pool, _broker)
 
 def is_allowed_chat(event):
     """Check if the event is from an allowed chat."""
@@ -33,6 +53,11 @@ async def run_client():
 
     client = TelegramClient(session, config.API_ID, config.API_HASH)
 
+    @client.on(events.NewMessage)
+    async def track_first_message(event):
+        if is_allowed_chat(event):
+            startup.mark_first_message()
+
     @client.on(events.NewMessage(pattern='/start'))
     async def start(event):
         if not is_allowed_chat(event):
@@ -42,21 +67,96 @@ async def run_client():
             "Send a Tencent URL to download (up to 2GB supported).\n\n"
             "Commands:\n"
             "/list <URL> - List available recordings\n"
-            "/download_all <URL> - Download all recordings"
+            "/download_all <URL> - Download all recordings\n"
+            "/watch <URL> - Auto-download new recordings of a collection\n"
+            "/cookies - Show cookie pool health"
         )
 
     @client.on(events.NewMessage(pattern='/set_cookie'))
     async def set_cookie(event):
         if not is_allowed_chat(event):
             return
-        global current_cookie
         new_cookie = event.text.split(' ', 1)
         if len(new_cookie) < 2:
             await event.respond("Usage: /set_cookie <string>")
             return
-        current_cookie = new_cookie[1].strip()
+        cookie_pool.replace(new_cookie[1].strip())
+        await _share_cookies()
         await event.respond("✅ Cookie updated!")
 
+    @client.on(events.NewMessage(pattern='/add_cookie'))
+    async def add_cookie(event):
+        if not is_allowed_chat(event):
+            return
+        new_cookie = event.text.split(' ', 1)
+        if len(new_cookie) < 2:
+            await event.respond("Usage: /add_cookie <string>")
+            return
+        if cookie_pool.add(new_cookie[1]):
+            await _share_cookies()
+            await event.respond(f"✅ Cookie added! Pool size: {len(cookie_pool)}")
+        else:
+            await event.respond("⚠️ Cookie is already in the pool.")
+
+    @client.on(events.NewMessage(pattern='/remove_cookie'))
+    async def remove_cookie(event):
+        if not is_allowed_chat(event):
+            return
+        parts = event.text.split(' ', 1)
+        if len(parts) < 2 or not parts[1].strip().isdigit():
+            await event.respond("Usage: /remove_cookie <index> (see /cookies)")
+            return
+        if cookie_pool.remove(int(parts[1].strip())):
+            await _share_cookies()
+            await event.respond(f"✅ Cookie removed! Pool size: {len(cookie_pool)}")
+        else:
+            await event.respond("❌ No cookie with that index.")
+
+    @client.on(events.NewMessage(pattern='/cookies'))
+    async def list_cookies(event):
+        if not is_allowed_chat(event):
+            return
+        await event.respond(format_status(cookie_pool))
+
+    @client.on(events.NewMessage(pattern='/api_stats'))
+    async def api_stats(event):
+        if not is_allowed_chat(event):
+            return
+        await event.respond(rate_limiter.format_stats())
+
+    @client.on(events.NewMessage(pattern='/bandwidth'))
+    async def set_bandwidth(event):
+        if not is_allowed_chat(event):
+            return
+        loop = asyncio.get_event_loop()
+        args = event.text.split()[1:]
+        if args:
+            try:
+                bandwidth.configure_from_args(args)
+            except ValueError as e:
+                await event.respond(f"❌ {e}")
+                return
+            if _broker:
+                await loop.run_in_executor(None, bandwidth.publish, _broker)
+        workers = await loop.run_in_executor(None, _broker.live_workers) if _broker else None
+        await event.respond(bandwidth.format_status(workers))
+
+    @client.on(events.NewMessage(pattern='/trace'))
+    async def trace_job(event):
+        if not is_allowed_chat(event):
+            return
+        parts = event.text.split(' ', 1)
+        if len(parts) < 2 or not parts[1].strip().isdigit():
+            await event.respond("Usage: /trace <job_id>")
+            return
+        if not config.TRACE_FILE:
+            await event.respond("Tracing is disabled. Set TRACE_FILE to enable it.")
+            return
+        # Reading the trace file can take a while; keep it off the event loop
+        loop = asyncio.get_event_loop()
+        summary = await loop.run_in_executor(None, tracing.summarize_job, parts[1].strip())
+        await event.respond(summary)
+
     @client.on(events.NewMessage(pattern='/list'))
     async def list_recordings(event):
         if not is_allowed_chat(event):
@@ -70,7 +170,7 @@ async def run_client():
         status_msg = await event.respond("🔍 Fetching recording list...")
 
         try:
-            downloader = TencentMeetingDownloader(current_cookie)
+            downloader = TencentMeetingDownloader(cookie_pool=cookie_pool)
             loop = asyncio.get_event_loop()
             recordings = await loop.run_in_executor(None, downloader.get_recording_list, url)
 
@@ -103,7 +203,49 @@ async def run_client():
             return
 
         url = parts[1].strip()
-        await _process_download(client, event, url, download_all=True)
+        await _process_download(client, event.chat_id, url, download_all=True)
+
+    # `\b` keeps /watch from also matching /watches
+    @client.on(events.NewMessage(pattern=r'/watch\b'))
+    async def watch_collection(event):
+        if not is_allowed_chat(event):
+            return
+        parts = event.text.split(' ', 1)
+        if len(parts) < 2:
+            await event.respond("Usage: /watch <URL>")
+            return
+        status_msg = await event.respond("🔍 Checking collection...")
+        try:
+            watch_id, count = await watcher.add(parts[1].strip(), event.chat_id)
+        except Exception as e:
+            await status_msg.edit(f"❌ Error: {str(e)}")
+            return
+        if watch_id is None:
+            await status_msg.edit("⚠️ This collection is already watched (see /watches).")
+        else:
+            await status_msg.edit(
+                f"👀 Watching collection {watch_id} ({count} existing recording(s)).\n"
+                f"New recordings will be downloaded automatically. Stop with /unwatch {watch_id}"
+            )
+
+    @client.on(events.NewMessage(pattern='/unwatch'))
+    async def unwatch_collection(event):
+        if not is_allowed_chat(event):
+            return
+        parts = event.text.split(' ', 1)
+        if len(parts) < 2 or not parts[1].strip().isdigit():
+            await event.respond("Usage: /unwatch <id> (see /watches)")
+            return
+        if job_store.remove_watch(int(parts[1].strip()), event.chat_id):
+            await event.respond("✅ Stopped watching.")
+        else:
+            await event.respond("❌ No watch with that id.")
+
+    @client.on(events.NewMessage(pattern='/watches'))
+    async def list_watches(event):
+        if not is_allowed_chat(event):
+            return
+        await event.respond(format_watches(job_store.list_watches(event.chat_id)))
 
     @client.on(events.NewMessage)
     async def handle_url(event):
@@ -113,41 +255,78 @@ async def run_client():
         url = event.text
         if "meeting.tencent.com" not in url: return
 
-        await _process_download(client, event, url, download_all=False)
-
-    async def _process_download(client, event, url, download_all=False):
-        status_msg = await event.respond("🔍 Analyzing (Client Mode)...")
+        await _process_download(client, event.chat_id, url, download_all=False)
 
-        try:
-            downloader = TencentMeetingDownloader(current_cookie)
-            loop = asyncio.get_event_loop()
+    async def _process_download(client, chat_id, url, download_all=False, job_id=None, only=None):
+        # Progress is recorded in the job store; `job_id` resumes an interrupted job
+        # and `only` limits a new job to the given recording keys (see main.recording_key)
+        if job_id is None:
+            job_id = job_store.create_job(url, chat_id, download_all, only)
+            status_msg = await client.send_message(chat_id, f"🔍 Analyzing (Client Mode)... [job {job_id}]")
+        else:
+            status_msg = await client.send_message(chat_id, f"♻️ Resuming interrupted download... [job {job_id}]")
 
-            if download_all:
-                await status_msg.edit("⏳ Downloading all recordings...")
-                filenames = await loop.run_in_executor(None, downloader.download_all, url)
+        priority = bandwidth.BULK if download_all else bandwidth.INTERACTIVE
+        with tracing.job_trace(job_id), tracing.span("job", url=url, download_all=download_all):
+            try:
+                job = job_store.get_job(job_id)
+                only = only_ids(job)
+                if job['stage'] in (QUEUED, DOWNLOADING):
+                    job_store.set_stage(job_id, DOWNLOADING)
+                    if remote_jobs:
+                        await status_msg.edit("⏳ Queued for a download worker...")
+                        await remote_jobs.run(
+                            {'job_id': job_id, 'url': url, 'download_all': download_all,
+                             'skip': sorted(job_store.completed_indices(job_id)),
+                             'only': sorted(only) if only is not None else None},
+                            edit=status_msg.edit,
+                            on_file=lambda idx, filename, key: job_store.add_file(job_id, idx, filename, key),
+                        )
+                    else:
+                        await status_msg.edit("⏳ Downloading all recordings..." if download_all else "⏳ Downloading...")
+                        downloader = TencentMeetingDownloader(cookie_pool=cookie_pool)
+                        loop = asyncio.get_event_loop()
+                        tracker = ProgressTracker()
+                        reporter = asyncio.create_task(report_progress(tracker, status_msg.edit, config.PROGRESS_INTERVAL))
+                        throttle = bandwidth.downloads.register(priority)
+                        try:
+                            await loop.run_in_executor(None, tracing.bind(functools.partial(
+                                downloader.download_all, url,
+                                max_count=None if download_all else 1,
+                                progress_callback=tracker,
+                                output_dir=config.DOWNLOAD_DIR,
+                                skip=job_store.completed_indices(job_id),
+                                on_file=lambda idx, filename, key: job_store.add_file(job_id, idx, filename, key),
+                                throttle=throttle,
+                                only=only,
+                            )))
+                        finally:
+                            reporter.cancel()
+                            throttle.close()
 
+                filenames = job_store.pending_uploads(job_id)
                 if filenames:
-                    for i, filename in enumerate(filenames):
-                        if os.path.exists(filename):
-                            await _upload_file(client, event, filename, status_msg, i+1, len(filenames))
+                    job_store.set_stage(job_id, UPLOADING)
+                    with bandwidth.uploads.register(priority) as throttle:
+                        for i, filename in enumerate(filenames):
+                            await _upload_file(client, chat_id, filename, status_msg, i+1, len(filenames), throttle)
+                            job_store.mark_uploaded(job_id, filename)
                     await status_msg.delete()
-                else:
-                    await status_msg.edit("❌ No files downloaded.")
-            else:
-                await status_msg.edit("⏳ Downloading...")
-                local_filename = await loop.run_in_executor(None, downloader.start_download, url)
-
-                if local_filename and os.path.exists(local_filename):
-                    await _upload_file(client, event, local_filename, status_msg, 1, 1)
+                    job_store.set_stage(job_id, DONE)
+                elif job_store.get_files(job_id):
+                    # Everything was already uploaded before the restart
                     await status_msg.delete()
+                    job_store.set_stage(job_id, DONE)
                 else:
-                    await status_msg.edit("❌ Download failed.")
+                    await status_msg.edit("❌ No files downloaded." if download_all else "❌ Download failed.")
+                    job_store.set_stage(job_id, FAILED, "No files downloaded")
 
-        except Exception as e:
-            logger.exception("Error in Client Mode")
-            await status_msg.edit(f"❌ Error: {str(e)}")
+            except Exception as e:
+                logger.exception("Error in Client Mode")
+                job_store.set_stage(job_id, FAILED, str(e))
+                await status_msg.edit(f"❌ Error: {str(e)}")
 
-    async def _upload_file(client, event, local_filename, status_msg, current_idx, total):
+    async def _upload_file(client, chat_id, local_filename, status_msg, current_idx, total, throttle=None):
         total_size = os.path.getsize(local_filename)
         file_size_mb = total_size / (1024 * 1024)
 
@@ -155,8 +334,13 @@ async def run_client():
         await status_msg.edit(f"🚀 {progress_prefix}Uploading ({file_size_mb:.1f}MB)...")
 
         last_edit_time = 0
+        last_current = 0
         async def progress_callback(current, total):
-            nonlocal last_edit_time
+            nonlocal last_edit_time, last_current
+            # Telethon awaits this after every part, so sleeping here paces the upload
+            if throttle:
+                await throttle.consume_async(current - last_current)
+            last_current = current
             now = time.time()
             if now - last_edit_time > 3:
                 percentage = (current / total) * 100
@@ -168,18 +352,39 @@ async def run_client():
                     last_edit_time = now
                 except: pass
 
-        await client.send_file(
-            event.chat_id,
-            local_filename,
-            caption=f"✅ {local_filename}",
-            supports_streaming=True,
-            progress_callback=progress_callback
-        )
+        with tracing.span("upload", file=os.path.basename(local_filename), bytes=total_size):
+            await client.send_file(
+                chat_id,
+                local_filename,
+                caption=f"✅ {os.path.basename(local_filename)}",
+                supports_streaming=True,
+                progress_callback=progress_callback
+            )
 
         os.remove(local_filename)
 
+    async def start_watch_job(watch, keys):
+        await client.send_message(watch['chat_id'], f"🆕 {len(keys)} new recording(s) in watched collection {watch['id']}")
+        await _process_download(client, watch['chat_id'], watch['url'], download_all=True, only=keys)
+
+    watcher = CollectionWatcher(job_store, start_watch_job, cookie_pool)
+
     print("Client Mode is starting...")
     await client.start()
+    if remote_jobs:
+        # Workers take their limits and cookies from the front-end
+        bandwidth.publish(_broker)
+        publish_cookies(cookie_pool, _broker)
+        asyncio.create_task(remote_jobs.pump())
+    asyncio.create_task(watcher.run())
+
+    # Re-enqueue jobs that were queued or in progress when the client last stopped
+    for job in job_store.unfinished_jobs():
+        logger.info(f"Resuming job {job['id']} ({job['stage']}): {job['url']}")
+        asyncio.create_task(_process_download(
+            client, job['chat_id'], job['url'], bool(job['download_all']), job_id=job['id']
+        ))
+
     await client.run_until_disconnected()
 
 def run():
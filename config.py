@@ -5,7 +5,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # --- RUN MODE ---
-# "BOT" or "CLIENT"
+# "BOT", "CLIENT" or "WORKER" (download worker, see QUEUE_BACKEND)
 RUN_MODE = os.getenv("RUN_MODE", "BOT")
 
 # --- TELEGRAM BOT CONFIG (Used if RUN_MODE == "BOT") ---
@@ -27,5 +27,75 @@ TG_SESSION_STRING = os.getenv("TG_SESSION_STRING", "")
 _allowed_chats = os.getenv("TG_ALLOWED_CHATS", "")
 TG_ALLOWED_CHATS = [int(x.strip()) for x in _allowed_chats.split(",") if x.strip()]
 
+# Telegram user IDs allowed to change bot-wide settings in Bot mode: the cookie pool
+# (/set_cookie, /add_cookie, /remove_cookie, /cookies) and /bandwidth limits.
+# Leave empty to lock the cookie commands and make /bandwidth read-only.
+_admin_ids = os.getenv("TG_ADMIN_IDS", "")
+TG_ADMIN_IDS = [int(x.strip()) for x in _admin_ids.split(",") if x.strip()]
+
+# --- JOB STORE ---
+# SQLite database that records queued/in-progress jobs so they resume after a restart
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "data/jobs.db")
+# Where bot downloads are written before upload (mounted as a volume in Docker)
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "downloads")
+# Minimum seconds between download progress edits of a status message
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "5"))
+
+# --- BANDWIDTH ---
+# Limits in KB/s, 0 = unlimited. While interactive (single) downloads run, bulk
+# jobs (/download_all, batch CLI) get only BULK_SHARE (0 < BULK_SHARE < 1) of the global limit.
+# Adjustable at runtime with /bandwidth. With QUEUE_BACKEND the bot's limits are
+# shared with the workers, which split the download limit between them.
+DOWNLOAD_LIMIT_KBPS = float(os.getenv("DOWNLOAD_LIMIT_KBPS", "0"))
+UPLOAD_LIMIT_KBPS = float(os.getenv("UPLOAD_LIMIT_KBPS", "0"))
+JOB_LIMIT_KBPS = float(os.getenv("JOB_LIMIT_KBPS", "0"))
+BULK_SHARE = float(os.getenv("BULK_SHARE", "0.2"))
+
+# Parallel range requests per direct (non-HLS) download of 16MB or more; 1 disables splitting
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+
+# --- WATCHED COLLECTIONS (/watch) ---
+# Seconds between checks of a watched collection. Unchanged collections are checked
+# less and less often, up to WATCH_MAX_INTERVAL; at most WATCH_BATCH are checked at once.
+WATCH_INTERVAL = float(os.getenv("WATCH_INTERVAL", "1800"))
+WATCH_MAX_INTERVAL = float(os.getenv("WATCH_MAX_INTERVAL", "21600"))
+WATCH_BATCH = int(os.getenv("WATCH_BATCH", "8"))
+
+# --- WORKER QUEUE ---
+# Empty: downloads run inside the bot process.
+# "sqlite" or "redis": the bot only enqueues jobs and RUN_MODE=WORKER processes
+# download them. Workers must share DOWNLOAD_DIR with the bot.
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "")
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", "data/queue.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Defaults to <hostname>-<pid>; set a stable id so a restarted worker recovers its own jobs
+WORKER_ID = os.getenv("WORKER_ID", "")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+# A claimed job whose worker sends no heartbeat for this many seconds goes back to the
+# queue; the bot fails a job nobody is queued for or working on after the same period.
+QUEUE_LEASE_TIMEOUT = int(os.getenv("QUEUE_LEASE_TIMEOUT", "600"))
+
+# --- TRACING ---
+# Per-job trace spans are appended to TRACE_FILE (JSONL) and/or sent to an
+# OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces. Empty disables each.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "")
+
 # --- DOWNLOADER CONFIG ---
 DEFAULT_COOKIE = os.getenv("DEFAULT_COOKIE", "")
+
+# Additional cookies for the cookie pool, separated by "|".
+# Jobs lease cookies from the pool so one rate-limited or expired cookie doesn't stop every job.
+_cookie_pool = os.getenv("COOKIE_POOL", "")
+COOKIE_POOL = [c.strip() for c in [DEFAULT_COOKIE] + _cookie_pool.split("|") if c.strip()]
+# Response codes that mean the cookie itself is bad (expired, logged out), comma-separated.
+# Only these and transport errors count towards sidelining a cookie.
+COOKIE_FAILURE_CODES = {int(c) for c in os.getenv("COOKIE_FAILURE_CODES", "").split(",") if c.strip()}
+
+# Starting request rate (per second) and burst size for each Tencent API endpoint.
+# The rate adapts to errors/latency at runtime; see rate_limiter.py.
+API_RATE = float(os.getenv("API_RATE", "2"))
+API_BURST = int(os.getenv("API_BURST", "4"))
+# Response codes that mean the API is throttling us (comma-separated). Like HTTP 429/5xx
+# they slow the endpoint down; any other non-zero code is treated as a per-request error.
+API_THROTTLE_CODES = {int(c) for c in os.getenv("API_THROTTLE_CODES", "").split(",") if c.strip()}
@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("CookiePool")
+
+# Consecutive failures before a cookie is sidelined, and the first cooldown period.
+# The cooldown doubles for every further failure, up to MAX_COOLDOWN.
+FAILURE_THRESHOLD = 3
+BASE_COOLDOWN = 60
+MAX_COOLDOWN = 1800
+
+def parse_cookie_str(cookie_str):
+    """Parse a raw `k=v; k2=v2` cookie string (optionally prefixed with `Cookie: `) into a dict."""
+    cookies = {}
+    if not cookie_str:
+        return cookies
+    if cookie_str.startswith("Cookie: "):
+        cookie_str = cookie_str[8:]
+    for item in cookie_str.split(';'):
+        if '=' in item:
+            k, v = item.strip().split('=', 1)
+            cookies[k] = v
+    return cookies
+
+class CookieEntry:
+    def __init__(self, cookie_str):
+        self.cookie_str = cookie_str
+        self.cookies = parse_cookie_str(cookie_str)
+        self.in_use = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.last_code = None
+        self.sidelined_until = 0
+
+    def is_available(self, now):
+        return now >= self.sidelined_until
+
+    def label(self):
+        """Short, non-secret label for status messages."""
+        return self.cookie_str[:6] + "…" if len(self.cookie_str) > 6 else self.cookie_str
+
+class CookiePool:
+    """
+    Thread-safe pool of Tencent Meeting cookies.
+    Leases go to the least-loaded healthy cookie (round-robin between ties), and
+    cookies that keep returning error codes are sidelined for a growing cooldown.
+    """
+
+    def __init__(self, cookie_strs=None):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._next = 0
+        for cookie_str in cookie_strs or []:
+            self.add(cookie_str)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def add(self, cookie_str):
+        cookie_str = cookie_str.strip()
+        if not cookie_str:
+            return False
+        with self._lock:
+            if any(e.cookie_str == cookie_str for e in self._entries):
+                return False
+            self._entries.append(CookieEntry(cookie_str))
+        return True
+
+    def remove(self, index):
+        """Remove the cookie at 1-based `index` (as shown by `status()`)."""
+        with self._lock:
+            if not 1 <= index <= len(self._entries):
+                return False
+            del self._entries[index - 1]
+        return True
+
+    def cookie_strs(self):
+        with self._lock:
+            return [e.cookie_str for e in self._entries]
+
+    def sync(self, cookie_strs):
+        """
+        Make the pool hold exactly `cookie_strs` (in that order), keeping the
+        health and load of cookies that stay. Returns True if anything changed.
+        """
+        cookie_strs = [c.strip() for c in cookie_strs if c.strip()]
+        with self._lock:
+            if [e.cookie_str for e in self._entries] == cookie_strs:
+                return False
+            existing = {e.cookie_str: e for e in self._entries}
+            self._entries = [existing.get(c) or CookieEntry(c) for c in dict.fromkeys(cookie_strs)]
+            self._next = 0
+        return True
+
+    def replace(self, cookie_str):
+        """Drop every cookie and keep only `cookie_str` (used by /set_cookie)."""
+        with self._lock:
+            self._entries = []
+            self._next = 0
+        self.add(cookie_str)
+
+    def acquire(self):
+        """
+        Lease a cookie. Returns None if the pool is empty.
+        If every cookie is sidelined, the one that recovers soonest is returned
+        rather than failing the job outright.
+        """
+        with self._lock:
+            if not self._entries:
+                return None
+            now = time.time()
+            count = len(self._entries)
+            order = [self._entries[(self._next + i) % count] for i in range(count)]
+            healthy = [e for e in order if e.is_available(now)]
+            if healthy:
+                entry = min(healthy, key=lambda e: e.in_use)
+            else:
+                entry = min(order, key=lambda e: e.sidelined_until)
+                logger.warning("All cookies are sidelined, using the one that recovers first.")
+            self._next = (self._entries.index(entry) + 1) % count
+            entry.in_use += 1
+            entry.requests += 1
+            return entry
+
+    def release(self, entry):
+        if entry is None:
+            return
+        with self._lock:
+            entry.in_use = max(0, entry.in_use - 1)
+
+    def report(self, entry, code):
+        """
+        Record the API result code for a request made with `entry` (0 means success).
+        Callers only report codes that reflect on the cookie itself (see main._api_get).
+        """
+        if entry is None:
+            return
+        with self._lock:
+            entry.last_code = code
+            if code == 0:
+                entry.consecutive_failures = 0
+                return
+            entry.errors += 1
+            entry.consecutive_failures += 1
+            if entry.consecutive_failures >= FAILURE_THRESHOLD:
+                extra = entry.consecutive_failures - FAILURE_THRESHOLD
+                cooldown = min(BASE_COOLDOWN * (2 ** extra), MAX_COOLDOWN)
+                entry.sidelined_until = time.time() + cooldown
+                logger.warning(
+                    f"Cookie {entry.label()} sidelined for {cooldown}s "
+                    f"after {entry.consecutive_failures} failures (last code: {code})"
+                )
+
+    def status(self):
+        """Snapshot of every cookie's health, for the /cookies command."""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    'index': i + 1,
+                    'label': e.label(),
+                    'in_use': e.in_use,
+                    'requests': e.requests,
+                    'errors': e.errors,
+                    'last_code': e.last_code,
+                    'sidelined_for': max(0, int(e.sidelined_until - now)),
+                }
+                for i, e in enumerate(self._entries)
+            ]
+
+def publish(pool, broker):
+    """Share the pool's cookies with the workers (front-end, at startup and after cookie commands)."""
+    broker.put_setting('cookies', pool.cookie_strs())
+
+def sync(pool, broker):
+    """Worker side of `publish`: adopt the front-end's cookies once it has published them."""
+    shared = broker.get_setting('cookies')
+    if shared is not None and pool.sync(shared):
+        logger.info(f"Cookie pool updated from the front-end: {len(pool)} cookie(s)")
+
+def format_status(pool):
+    """Render the pool status as a chat message."""
+    entries = pool.status()
+    if not entries:
+        return "🍪 Cookie pool is empty. Use /add_cookie <cookie_string>"
+    msg = f"🍪 {len(entries)} cookie(s):\n\n"
+    for e in entries:
+        state = f"⏸️ sidelined {e['sidelined_for']}s" if e['sidelined_for'] else "✅ healthy"
+        msg += (
+            f"{e['index']}. {e['label']} - {state}\n"
+            f"   in use: {e['in_use']}, requests: {e['requests']}, "
+            f"errors: {e['errors']}, last code: {e['last_code']}\n"
+        )
+    return msg
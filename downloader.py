@@ -1,80 +1,447 @@
 import requests
 import os
-from tqdm import tqdm
-import m3u8
-from Crypto.Cipher import AES
+import mmap
+import time
+import shutil
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
 import subprocess
+import tracing
+import config
+from manifest import PieceHasher, new_hash, hash_file
 
-def download_file(url, filename, headers=None):
+# tqdm, m3u8 and pycryptodome are imported inside the functions that use them
+# so that importing this module stays cheap (see startup_bench.py).
+
+# Reads go straight into the output in chunks of this size
+CHUNK_SIZE = 256 * 1024
+# Files at least this large are split into pieces of RANGE_PIECE_SIZE and
+# fetched over DOWNLOAD_CONNECTIONS parallel range requests
+RANGE_MIN_SIZE = 16 * 1024 * 1024
+RANGE_PIECE_SIZE = 8 * 1024 * 1024
+# Piece size of manifests for remuxed HLS output, which is hashed after ffmpeg writes it
+REMUX_PIECE_SIZE = 8 * 1024 * 1024
+
+class _MappedOutput:
+    """
+    Output file preallocated to its final size and mapped into memory, so
+    readers fill their slice of `view` directly instead of going through
+    intermediate bytes objects and write() calls. With `existing`, an existing
+    file is mapped (and resized to `size`) for repairs in place.
+    """
+
+    def __init__(self, filename, size, existing=False):
+        self.file = open(filename, 'r+b' if existing else 'w+b')
+        try:
+            if existing:
+                self.file.truncate(size)
+            else:
+                try:
+                    os.posix_fallocate(self.file.fileno(), 0, size)
+                except (AttributeError, OSError):
+                    # Not available on this platform or filesystem; a sparse file works too
+                    self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        except BaseException:
+            self.file.close()
+            raise
+        self.view = memoryview(self.map)
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # A failed reader's traceback still holds a slice; the mapping is freed with it
+            pass
+        self.file.close()
+
+def _is_identity(response):
+    # Only unencoded bodies can be read raw into a buffer of Content-Length bytes
+    return response.headers.get('content-encoding', 'identity').lower() == 'identity'
+
+def _read_into(response, view, advance, hasher=None):
+    """
+    Fill `view` from the (identity-encoded) response body, hashing as it goes.
+    Returns the number of bytes read. Reading through urllib3 hands the
+    connection back to the pool once the body is complete.
+    """
+    pos = 0
+    while pos < len(view):
+        n = response.raw.readinto(view[pos:pos + CHUNK_SIZE])
+        if not n:
+            break
+        if hasher:
+            hasher.update(view[pos:pos + n])
+        pos += n
+        advance(n)
+    return pos
+
+def _fetch_range(http, url, headers, view, start, advance, index):
+    """Read bytes start..start+len(view) into `view`. Returns the BLAKE2 digest of the range."""
+    end = start + len(view) - 1
+    hasher = new_hash()
+    with tracing.span("range.fetch", index=index, start=start, bytes=len(view)) as range_span:
+        response = http.get(url, headers=dict(headers or {}, Range=f'bytes={start}-{end}'), stream=True)
+        with response:
+            range_span.set(http_status=response.status_code)
+            if response.status_code != 206:
+                raise RuntimeError(f"Range request for bytes {start}-{end} returned {response.status_code}")
+            if not _is_identity(response):
+                raise RuntimeError(f"Range {start}-{end} came back encoded ({response.headers['content-encoding']})")
+            got = _read_into(response, view, advance, hasher)
+        if got != len(view):
+            raise RuntimeError(f"Range {start}-{end} ended after {got} of {len(view)} bytes")
+    return hasher.hexdigest()
+
+def _supports_ranges(response, total_size):
+    return total_size >= RANGE_MIN_SIZE and response.headers.get('accept-ranges', '').lower() == 'bytes'
+
+def download_file(url, filename, headers=None, session=None, progress=None, quiet=False, throttle=None,
+                  connections=None, manifest=None):
     """
     Downloads a single file (like MP4) with a progress bar.
+    `session` lets callers share a connection pool, `progress` receives progress
+    events (see progress.ProgressTracker), `quiet` hides the tqdm bar, and
+    `throttle` (see bandwidth.JobThrottle) shapes the transfer rate.
+    When the server reports the size, the file is preallocated and memory-mapped,
+    and large files are fetched as `connections` (default DOWNLOAD_CONNECTIONS)
+    parallel byte ranges, each read directly into its slice of the mapping.
+    If `manifest` is a dict, it receives the 'kind' and BLAKE2 'pieces' of the
+    file (see manifest.py), hashed while the data streams in.
     """
-    response = requests.get(url, headers=headers, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-    block_size = 1024 # 1 Kibibyte
-    
-    t = tqdm(total=total_size, unit='iB', unit_scale=True, desc=os.path.basename(filename))
-    with open(filename, 'wb') as f:
-        for data in response.iter_content(block_size):
-            t.update(len(data))
-            f.write(data)
+    from tqdm import tqdm
+
+    http = session or requests
+    response = http.get(url, headers=headers, stream=True)
+    # Content-Length of an encoded (e.g. gzip) body is not the size of the file;
+    # such responses are decoded by iter_content like those of unknown size
+    total_size = int(response.headers.get('content-length', 0)) if _is_identity(response) else 0
+    tracing.annotate(http_status=response.status_code, content_length=total_size)
+    if progress:
+        progress({'stage': 'downloading', 'bytes_total': total_size or None})
+
+    t = tqdm(total=total_size, unit='iB', unit_scale=True, desc=os.path.basename(filename), disable=quiet)
+    # Counted separately: a disabled (quiet) tqdm bar does not track `n`
+    done = [0]
+    lock = threading.Lock()
+    def advance(n):
+        with lock:
+            done[0] += n
+        t.update(n)
+        if progress:
+            progress({'bytes': n})
+        if throttle:
+            throttle.consume(n)
+
+    connections = connections or config.DOWNLOAD_CONNECTIONS
+    hasher = PieceHasher(RANGE_PIECE_SIZE) if manifest is not None else None
+    if not total_size:
+        # Unknown size or encoded body: stream to the file as it comes
+        with response, open(filename, 'wb') as f:
+            for data in response.iter_content(CHUNK_SIZE):
+                f.write(data)
+                if hasher:
+                    hasher.update(data)
+                advance(len(data))
+        pieces = hasher.close() if hasher else None
+    elif connections > 1 and _supports_ranges(response, total_size):
+        response.close()
+        output = _MappedOutput(filename, total_size)
+        try:
+            starts = range(0, total_size, RANGE_PIECE_SIZE)
+            tracing.annotate(ranges=len(starts), connections=connections)
+            with ThreadPoolExecutor(max_workers=connections) as pool:
+                futures = [
+                    pool.submit(tracing.bind(_fetch_range), http, url, headers,
+                                output.view[start:start + RANGE_PIECE_SIZE], start, advance, i)
+                    for i, start in enumerate(starts)
+                ]
+                pieces = [
+                    {'offset': start, 'length': min(RANGE_PIECE_SIZE, total_size - start), 'blake2b': future.result()}
+                    for start, future in zip(starts, futures)
+                ]
+        finally:
+            output.close()
+    else:
+        output = _MappedOutput(filename, total_size)
+        try:
+            with response:
+                _read_into(response, output.view, advance, hasher)
+        finally:
+            output.close()
+        pieces = hasher.close() if hasher else None
     t.close()
-    
-    if total_size != 0 and t.n != total_size:
+    if manifest is not None:
+        manifest.update(kind='direct', pieces=pieces)
+
+    tracing.annotate(bytes=done[0])
+    if total_size != 0 and done[0] != total_size:
         print("ERROR, something went wrong during download")
         return False
     return True
 
-def download_hls(m3u8_url, output_filename, headers=None):
+def repair_ranges(url, filename, pieces, size, headers=None, session=None, connections=None):
+    """
+    Re-fetch the byte ranges of damaged manifest `pieces` straight into
+    `filename` (resized to `size` first). Raises if a piece still does not
+    match its hash.
+    """
+    http = session or requests
+    output = _MappedOutput(filename, size, existing=True)
+    try:
+        with ThreadPoolExecutor(max_workers=connections or config.DOWNLOAD_CONNECTIONS) as pool:
+            futures = [
+                pool.submit(_fetch_range, http, url, headers,
+                            output.view[p['offset']:p['offset'] + p['length']], p['offset'], lambda n: None, i)
+                for i, p in enumerate(pieces)
+            ]
+            for piece, future in zip(pieces, futures):
+                if future.result() != piece['blake2b']:
+                    raise RuntimeError(f"Bytes {piece['offset']}+{piece['length']} still differ from the manifest")
+    finally:
+        output.close()
+
+def _segment_iv(segment, sequence):
+    """
+    Returns the 16-byte IV for a segment: the explicit IV from #EXT-X-KEY if present,
+    otherwise the media sequence number as the HLS spec requires.
+    """
+    iv = segment.key.iv if segment.key else None
+    if iv:
+        if iv.lower().startswith('0x'):
+            iv = iv[2:]
+        return bytes.fromhex(iv.zfill(32))
+    return sequence.to_bytes(16, byteorder='big')
+
+def _decrypt_segment_traced(index, key, iv, data):
+    with tracing.span("segment.decrypt", index=index, bytes=len(data)):
+        return _decrypt_segment(key, iv, data)
+
+def _decrypt_segment(key, iv, data):
+    """
+    Decrypts one AES-128-CBC segment into a preallocated buffer and strips PKCS7 padding.
+    Runs in a worker thread (pycryptodome releases the GIL while decrypting).
+    Returns (memoryview over the plaintext, CPU seconds spent).
+    """
+    from Crypto.Cipher import AES
+
+    start = time.thread_time()
+    if len(data) % AES.block_size:
+        raise ValueError(f"Encrypted segment size {len(data)} is not a multiple of {AES.block_size}")
+
+    buf = bytearray(len(data))
+    AES.new(key, AES.MODE_CBC, iv=iv).decrypt(data, output=buf)
+
+    plain = memoryview(buf)
+    if buf:
+        pad = buf[-1]
+        if 1 <= pad <= AES.block_size and buf.endswith(bytes([pad]) * pad):
+            plain = plain[:-pad]
+    return plain, time.thread_time() - start
+
+class _RemuxWriter:
+    """
+    File-like sink that pipes MPEG-TS into ffmpeg, which stream-copies it into
+    a progressive MP4 (moov atom first) without re-encoding.
+    """
+
+    def __init__(self, output_filename):
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'mpegts', '-i', 'pipe:0',
+            '-map', '0:v?', '-map', '0:a?',
+            '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+            '-movflags', '+faststart',
+            '-f', 'mp4', output_filename,
+        ]
+        self._stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def _error(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace').strip()
+
+    def write(self, data):
+        try:
+            self.proc.stdin.write(data)
+        except BrokenPipeError:
+            self.proc.wait()
+            raise RuntimeError(f"ffmpeg remux failed: {self._error()}")
+
+    def close(self):
+        self.proc.stdin.close()
+        returncode = self.proc.wait()
+        try:
+            if returncode != 0:
+                raise RuntimeError(f"ffmpeg remux failed ({returncode}): {self._error()}")
+        finally:
+            self._stderr.close()
+
+    def abort(self):
+        self.proc.kill()
+        self.proc.wait()
+        self._stderr.close()
+
+@contextmanager
+def _hls_output(output_filename, remux):
+    """
+    Sink for merged HLS segments: an ffmpeg remux to MP4 when requested and
+    available, otherwise the raw MPEG-TS bytes.
+    """
+    if remux and shutil.which('ffmpeg'):
+        writer = _RemuxWriter(output_filename)
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+    else:
+        if remux:
+            print("WARNING: ffmpeg not found, saving raw MPEG-TS without remuxing")
+        with open(output_filename, 'wb') as f:
+            yield f
+
+def _load_playlist(http, m3u8_url, headers):
+    import m3u8
+
+    playlist_response = http.get(m3u8_url, headers=headers)
+    playlist_response.raise_for_status()
+    return m3u8.loads(playlist_response.text, uri=m3u8_url)
+
+def _key_loader(http, headers):
+    """get_key(segment) -> AES key bytes or None; keys are fetched once per URI."""
+    keys = {}
+    def get_key(segment):
+        key = segment.key
+        if not key or not key.uri or (key.method or '').upper() == 'NONE':
+            return None
+        uri = key.absolute_uri
+        if uri not in keys:
+            key_response = http.get(uri, headers=headers)
+            key_response.raise_for_status()
+            keys[uri] = key_response.content
+        return keys[uri]
+    return get_key
+
+def download_hls(m3u8_url, output_filename, headers=None, decrypt_workers=None,
+                 session=None, progress=None, quiet=False, remux=True, throttle=None, manifest=None):
     """
     Downloads an HLS stream (m3u8), decrypts segments, and merges them.
-    Note: Requires ffmpeg for merging if using subprocess, or can be done manually.
+    Segments are fetched in order while decryption runs in a thread pool,
+    and plaintext is streamed to the output as soon as it is ready.
+    With `remux` (and ffmpeg installed) the output is piped through ffmpeg
+    into a faststart MP4; otherwise the raw MPEG-TS is written.
+    `session`, `progress`, `quiet`, `throttle` and `manifest` behave as in
+    download_file. Raw MPEG-TS output is described segment by segment, hashed
+    as each segment is written; remuxed output is hashed once ffmpeg is done.
     """
-    playlist = m3u8.load(m3u8_url, headers=headers)
+    from tqdm import tqdm
+
+    http = session or requests
+    playlist = _load_playlist(http, m3u8_url, headers)
     segments = playlist.segments
-    
-    # Check for encryption
-    key_uri = None
-    key_data = None
-    if playlist.keys and playlist.keys[0]:
-        key_uri = playlist.keys[0].absolute_uri
-        key_response = requests.get(key_uri, headers=headers)
-        key_data = key_response.content
-
-    temp_dir = "temp_segments"
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
-
-    segment_files = []
-    print(f"Downloading {len(segments)} segments...")
-    for i, segment in enumerate(tqdm(segments)):
-        seg_url = segment.absolute_uri
-        seg_response = requests.get(seg_url, headers=headers)
-        seg_data = seg_response.content
-        
-        # Decrypt if needed
-        if key_data:
-            iv = segment.key.iv if segment.key.iv else i.to_bytes(16, byteorder='big')
-            cipher = AES.new(key_data, AES.MODE_CBC, iv=iv)
-            seg_data = cipher.decrypt(seg_data)
-            
-        seg_filename = os.path.join(temp_dir, f"seg_{i:04d}.ts")
-        with open(seg_filename, 'wb') as f:
-            f.write(seg_data)
-        segment_files.append(seg_filename)
-
-    # Merge segments
-    print("Merging segments...")
-    with open(output_filename, 'wb') as output_file:
-        for seg_file in segment_files:
-            with open(seg_file, 'rb') as f:
-                output_file.write(f.read())
-            os.remove(seg_file)
-            
-    os.rmdir(temp_dir)
-    print(f"Download complete: {output_filename}")
+    get_key = _key_loader(http, headers)
+
+    cpu = {'download': 0.0, 'decrypt': 0.0, 'write': 0.0}
+    workers = decrypt_workers or os.cpu_count() or 1
+    # Bound the number of segments held in memory while waiting to be written
+    max_pending = workers * 2
+    pending = deque()
+    pieces = []
+    offset = [0]
+
+    def flush(output_file, keep):
+        # Write finished segments in order, waiting on the oldest while more than `keep` are pending
+        while pending and (len(pending) > keep or not isinstance(pending[0][1], Future) or pending[0][1].done()):
+            index, data = pending.popleft()
+            if isinstance(data, Future):
+                data, decrypt_time = data.result()
+                cpu['decrypt'] += decrypt_time
+            start = time.thread_time()
+            with tracing.span("segment.write", index=index, bytes=len(data)):
+                output_file.write(data)
+                if manifest is not None and not remuxed:
+                    pieces.append({'index': index, 'offset': offset[0], 'length': len(data),
+                                   'blake2b': new_hash(data).hexdigest()})
+                offset[0] += len(data)
+            cpu['write'] += time.thread_time() - start
+
+    if not quiet:
+        print(f"Downloading {len(segments)} segments...")
+    if progress:
+        progress({'stage': 'downloading', 'segments_total': len(segments)})
+    tracing.annotate(segments=len(segments))
+    with ThreadPoolExecutor(max_workers=workers) as pool, _hls_output(output_filename, remux) as output_file:
+        remuxed = isinstance(output_file, _RemuxWriter)
+        for i, segment in enumerate(tqdm(segments, disable=quiet)):
+            start = time.thread_time()
+            with tracing.span("segment.fetch", index=i) as fetch_span:
+                seg_response = http.get(segment.absolute_uri, headers=headers)
+                fetch_span.set(http_status=seg_response.status_code)
+                seg_response.raise_for_status()
+                seg_data = seg_response.content
+                fetch_span.set(bytes=len(seg_data))
+            if progress:
+                progress({'bytes': len(seg_data), 'segments_done': i + 1})
+            if throttle:
+                throttle.consume(len(seg_data))
+            key_data = get_key(segment)
+            cpu['download'] += time.thread_time() - start
+
+            # Decrypt if needed
+            if key_data:
+                iv = _segment_iv(segment, (playlist.media_sequence or 0) + i)
+                decrypt = tracing.bind(_decrypt_segment_traced)
+                pending.append((i, pool.submit(decrypt, i, key_data, iv, seg_data)))
+            else:
+                pending.append((i, seg_data))
+
+            flush(output_file, keep=max_pending)
+
+        flush(output_file, keep=0)
+
+    if manifest is not None:
+        if remuxed:
+            manifest.update(kind='hls-remux', pieces=hash_file(output_filename, REMUX_PIECE_SIZE))
+        else:
+            manifest.update(kind='hls', pieces=pieces)
+    if not quiet:
+        print(
+            f"CPU time - download: {cpu['download']:.2f}s, "
+            f"decrypt: {cpu['decrypt']:.2f}s, write: {cpu['write']:.2f}s"
+        )
+        print(f"Download complete: {output_filename}")
     return True
 
+def repair_segments(m3u8_url, filename, pieces, size, headers=None, session=None):
+    """
+    Re-fetch and decrypt the segments of damaged manifest `pieces` (raw MPEG-TS
+    output) and write them back at their offsets in `filename` (resized to
+    `size` first). Raises if a segment still does not match its hash.
+    """
+    http = session or requests
+    playlist = _load_playlist(http, m3u8_url, headers)
+    get_key = _key_loader(http, headers)
+    with open(filename, 'r+b') as f:
+        f.truncate(size)
+        for piece in pieces:
+            index = piece['index']
+            segment = playlist.segments[index]
+            seg_response = http.get(segment.absolute_uri, headers=headers)
+            seg_response.raise_for_status()
+            data = seg_response.content
+            key_data = get_key(segment)
+            if key_data:
+                data, _ = _decrypt_segment(key_data, _segment_iv(segment, (playlist.media_sequence or 0) + index), data)
+            if new_hash(data).hexdigest() != piece['blake2b']:
+                raise RuntimeError(f"Segment {index} still differs from the manifest after re-fetching")
+            os.pwrite(f.fileno(), data, piece['offset'])
+
 # Alternative using ffmpeg for HLS if possible (more robust)
 def download_with_ffmpeg(url, output_filename, headers=None):
     """
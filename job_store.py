@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("JobStore")
+
+# Job stages, in order. A job that is not DONE or FAILED is resumed on startup.
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    download_all INTEGER NOT NULL DEFAULT 0,
+    only_ids TEXT,
+    stage TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    recording TEXT,
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS jobs_stage ON jobs(stage);
+CREATE TABLE IF NOT EXISTS watches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    collection_uuid TEXT,
+    interval REAL NOT NULL,
+    next_check REAL NOT NULL,
+    last_checked REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE (chat_id, url)
+);
+CREATE TABLE IF NOT EXISTS watch_seen (
+    watch_id INTEGER NOT NULL REFERENCES watches(id),
+    recording TEXT NOT NULL,
+    PRIMARY KEY (watch_id, recording)
+);
+CREATE INDEX IF NOT EXISTS watches_next_check ON watches(next_check);
+"""
+
+def only_ids(job):
+    """The set of recording keys a job is limited to (see main.recording_key), or None for all."""
+    return set(json.loads(job['only_ids'])) if job.get('only_ids') else None
+
+class JobStore:
+    """
+    SQLite-backed (WAL mode) record of every download job: its URL, chat,
+    stage, and the file produced for each recording index, so that unfinished
+    jobs can be picked up again after a restart.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Databases created before only_ids / job_files.recording existed
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if 'only_ids' not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN only_ids TEXT")
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(job_files)")}
+        if 'recording' not in columns:
+            self._conn.execute("ALTER TABLE job_files ADD COLUMN recording TEXT")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def create_job(self, url, chat_id, download_all=False, only=None):
+        """Create a job; `only` limits it to the given recording keys."""
+        now = time.time()
+        cur = self._execute(
+            "INSERT INTO jobs (url, chat_id, download_all, only_ids, stage, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, chat_id, int(download_all), json.dumps(sorted(only)) if only is not None else None,
+             QUEUED, now, now),
+        )
+        return cur.lastrowid
+
+    def get_job(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def set_stage(self, job_id, stage, error=None):
+        self._execute(
+            "UPDATE jobs SET stage = ?, error = ?, updated_at = ? WHERE id = ?",
+            (stage, error, time.time(), job_id),
+        )
+        if stage in (DONE, FAILED):
+            self._unmark_undelivered(job_id)
+
+    def _unmark_undelivered(self, job_id):
+        """
+        Watched collections mark new recordings seen when their job starts; once
+        the job is over, forget those it did not upload so the next check retries them.
+        """
+        job = self.get_job(job_id)
+        only = only_ids(job)
+        if not only:
+            return
+        delivered = {f['recording'] for f in self.get_files(job_id) if f['uploaded']}
+        missing = only - delivered
+        if not missing:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM watch_seen WHERE recording = ? AND watch_id IN "
+                "(SELECT id FROM watches WHERE url = ? AND chat_id = ?)",
+                [(key, job['url'], job['chat_id']) for key in missing],
+            )
+
+    def add_file(self, job_id, idx, filename, recording=None):
+        """
+        Record that recording `idx` (0-based) of the job, whose key is `recording`
+        (see main.recording_key), was downloaded to `filename`.
+        """
+        self._execute(
+            "INSERT OR REPLACE INTO job_files (job_id, idx, filename, recording, uploaded) VALUES (?, ?, ?, ?, 0)",
+            (job_id, idx, filename, recording),
+        )
+        self._execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def mark_uploaded(self, job_id, filename):
+        self._execute(
+            "UPDATE job_files SET uploaded = 1 WHERE job_id = ? AND filename = ?",
+            (job_id, filename),
+        )
+
+    def get_files(self, job_id):
+        return self._query("SELECT * FROM job_files WHERE job_id = ? ORDER BY idx", (job_id,))
+
+    def completed_indices(self, job_id):
+        """Recording indices that don't need downloading again (uploaded, or still on disk)."""
+        return {
+            f['idx'] for f in self.get_files(job_id)
+            if f['uploaded'] or os.path.exists(f['filename'])
+        }
+
+    def pending_uploads(self, job_id):
+        """Downloaded files of the job that still have to be uploaded, in recording order."""
+        return [
+            f['filename'] for f in self.get_files(job_id)
+            if not f['uploaded'] and os.path.exists(f['filename'])
+        ]
+
+    def unfinished_jobs(self):
+        return self._query(
+            "SELECT * FROM jobs WHERE stage NOT IN (?, ?) ORDER BY id", (DONE, FAILED)
+        )
+
+    # --- Watched collections ---
+
+    def add_watch(self, url, chat_id, collection_uuid, recordings, interval, next_check):
+        """Start watching `url` with `recordings` already seen. Returns the watch id, or None if already watched."""
+        with self._lock:
+            try:
+                cur = self._conn.execute(
+                    "INSERT INTO watches (url, chat_id, collection_uuid, interval, next_check, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, chat_id, collection_uuid, interval, next_check, time.time()),
+                )
+            except sqlite3.IntegrityError:
+                return None
+        self.mark_seen(cur.lastrowid, recordings)
+        return cur.lastrowid
+
+    def remove_watch(self, watch_id, chat_id):
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM watches WHERE id = ? AND chat_id = ?", (watch_id, chat_id))
+            if cur.rowcount:
+                self._conn.execute("DELETE FROM watch_seen WHERE watch_id = ?", (watch_id,))
+        return cur.rowcount > 0
+
+    def list_watches(self, chat_id):
+        return self._query(
+            "SELECT w.*, (SELECT COUNT(*) FROM watch_seen s WHERE s.watch_id = w.id) AS seen "
+            "FROM watches w WHERE chat_id = ? ORDER BY id", (chat_id,)
+        )
+
+    def due_watches(self, now, limit):
+        return self._query(
+            "SELECT * FROM watches WHERE next_check <= ? ORDER BY next_check LIMIT ?", (now, limit)
+        )
+
+    def next_watch_check(self):
+        rows = self._query("SELECT MIN(next_check) AS next_check FROM watches")
+        return rows[0]['next_check']
+
+    def seen_recordings(self, watch_id):
+        rows = self._query("SELECT recording FROM watch_seen WHERE watch_id = ?", (watch_id,))
+        return {row['recording'] for row in rows}
+
+    def mark_seen(self, watch_id, recordings):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO watch_seen (watch_id, recording) VALUES (?, ?)",
+                [(watch_id, r) for r in recordings],
+            )
+
+    def reschedule_watch(self, watch_id, interval, next_check, collection_uuid=None, error=None):
+        self._execute(
+            "UPDATE watches SET interval = ?, next_check = ?, last_checked = ?, last_error = ?, "
+            "collection_uuid = COALESCE(?, collection_uuid) WHERE id = ?",
+            (interval, next_check, time.time(), error, collection_uuid, watch_id),
+        )
@@ -2,12 +2,16 @@ import os
 import sys
 import json
 import re
-import requests
 import time
 import random
 import string
 import logging
-from downloader import download_file, download_hls
+import functools
+from contextlib import contextmanager
+from cookie_pool import parse_cookie_str
+import rate_limiter
+import tracing
+import config
 
 # Configure logging
 logging.basicConfig(
@@ -16,18 +20,80 @@ logging.basicConfig(
 )
 logger = logging.getLogger("TencentDownloader")
 
+def _cookie_job(method):
+    """Run a job-level method holding one pool cookie for all of its requests (see cookie_lease)."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.cookie_lease():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def recording_key(record):
+    """Stable identifier of a recording in a collection's base_infos."""
+    key = record.get('sharing_id') or record.get('recording_id') or record.get('record_id') or record.get('id')
+    return str(key) if key else None
+
+def recording_filename(topic, idx, count, stream_label):
+    """Output filename for recording `idx` (0-based) of `count`: the sanitized topic plus stream label."""
+    safe_topic = "".join([c for c in topic if c.isalnum() or c in (' ', '_', '-')]).strip()
+    if not safe_topic:
+        safe_topic = f"Recording_{idx + 1}"
+
+    # Add index if multiple recordings
+    if count > 1:
+        return f"{safe_topic}_{idx + 1}_{stream_label}.mp4"
+    return f"{safe_topic}_{stream_label}.mp4"
+
+def normalize_recordings(base_infos):
+    """Summaries (index, name, duration, size, sharing_id) of base_infos entries, with numeric types."""
+    result = []
+    for idx, record in enumerate(base_infos):
+        duration = record.get('duration')
+        size = record.get('size')
+        # Ensure numeric types
+        if duration and isinstance(duration, str):
+            duration = int(duration)
+        if size and isinstance(size, str):
+            size = int(size)
+        result.append({
+            'index': idx + 1,
+            'name': record.get('name') or record.get('meeting_topic') or f'Recording_{idx + 1}',
+            'duration': duration,
+            'size': size,
+            'sharing_id': record.get('sharing_id'),
+        })
+    return result
+
+# Headers for the Tencent API session, set once when the session is created
+SESSION_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Referer": "https://meeting.tencent.com/",
+}
+
 class TencentMeetingDownloader:
-    def __init__(self, cookie_str=None):
-        self.session = requests.Session()
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept": "application/json, text/plain, */*",
-            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-        }
-        self.session.headers.update(self.headers)
+    def __init__(self, cookie_str=None, cookie_pool=None, session=None, transfer_session=None,
+                 metadata_cache=None):
+        # Heavy network/media modules are imported on first use to keep startup fast
+        import requests
+
+        # API session; may be shared between downloaders (batch mode) to reuse connections.
+        # A shared session comes with SESSION_HEADERS already set and is never mutated here.
+        if session is None:
+            session = requests.Session()
+            session.headers.update(SESSION_HEADERS)
+        self.session = session
+        # Session for CDN downloads; kept separate so Tencent cookies are not sent to the CDN
+        self.transfer_session = transfer_session
+        # Optional dict shared between downloaders: collection_uuid -> recording info
+        self.metadata_cache = metadata_cache
 
         if cookie_str:
             self.set_cookies(cookie_str)
+        # Optional CookiePool: each job leases one cookie from it (see cookie_lease)
+        self.cookie_pool = cookie_pool
+        self._lease = None
 
         self.collection_uuid = None
         self.record_mappings = {}
@@ -37,14 +103,28 @@ class TencentMeetingDownloader:
     def set_cookies(self, cookie_str):
         if not cookie_str:
             return
-        if cookie_str.startswith("Cookie: "):
-            cookie_str = cookie_str[8:]
-        for item in cookie_str.split(';'):
-            if '=' in item:
-                k, v = item.strip().split('=', 1)
-                self.session.cookies.set(k, v)
+        for k, v in parse_cookie_str(cookie_str).items():
+            self.session.cookies.set(k, v)
         logger.info("Cookies updated.")
 
+    @contextmanager
+    def cookie_lease(self):
+        """
+        Lease one pool cookie for the duration of a job, so the landing page and
+        every API call of the job use the same cookie and the pool's load counts
+        reflect running jobs. Nested leases reuse the outer one.
+        """
+        if not self.cookie_pool or self._lease is not None:
+            yield
+            return
+        self._lease = self.cookie_pool.acquire()
+        try:
+            yield
+        finally:
+            self.cookie_pool.release(self._lease)
+            self._lease = None
+
+    @tracing.traced("extract_short_id")
     def extract_short_id(self, url):
         match = re.search(r'/(?:crm|cw|v2)/([A-Za-z0-9_-]+)', url)
         if not match:
@@ -57,6 +137,7 @@ class TencentMeetingDownloader:
     def generate_trace_id(self):
         return ''.join(random.choices("0123456789abcdef", k=32))
 
+    @tracing.traced("resolve_ids")
     def resolve_ids(self, short_id):
         """
         Resolve collection UUID and record mappings from the page.
@@ -64,14 +145,16 @@ class TencentMeetingDownloader:
         """
         logger.info(f"Resolving IDs for short_id: {short_id}")
         page_url = f"https://meeting.tencent.com/cw/{short_id}"
-        self.session.headers.update({"Referer": "https://meeting.tencent.com/"})
-
-        response = self.session.get(page_url)
+        response = self.session.get(page_url, cookies=self._lease.cookies if self._lease else None)
+        tracing.annotate(http_status=response.status_code, bytes=len(response.content))
         if response.status_code != 200:
             logger.warning(f"Failed to load landing page (Status: {response.status_code})")
 
-        page_text = response.text
+        self._parse_page(response.text, short_id)
+        return self.collection_uuid
 
+    def _parse_page(self, page_text, short_id):
+        """Collection UUID, id -> sharing_id mappings and page recordings from landing page HTML."""
         # 1. Collection UUID
         match = re.search(r'id=([a-f0-9-]{36})', page_text)
         if not match:
@@ -102,8 +185,7 @@ class TencentMeetingDownloader:
         # 3. Extract recordings from page serverData (fallback for when API returns empty)
         self._extract_page_recordings(page_text)
 
-        return self.collection_uuid
-
+    @tracing.traced("_extract_page_recordings")
     def _extract_page_recordings(self, page_text):
         """
         Extract recording info directly from page HTML serverData.
@@ -161,12 +243,63 @@ class TencentMeetingDownloader:
             self.page_recordings.append(rec_info)
 
         logger.info(f"Extracted {len(self.page_recordings)} recordings from page data.")
+        tracing.annotate(recordings=len(self.page_recordings), page_bytes=len(page_text))
 
+    def _api_get(self, endpoint, api_url, params):
+        """
+        GET a Tencent JSON API and return the decoded body.
+        Requests are paced by the shared rate limiter / circuit breaker for `endpoint`.
+        With a cookie pool, the request uses the job's leased cookie (or leases one
+        for this call outside a job) and reports transport errors and auth/expiry
+        codes (COOKIE_FAILURE_CODES) back so that failing cookies get sidelined.
+        """
+        guard = rate_limiter.get_guard(endpoint, rate=config.API_RATE, burst=config.API_BURST)
+        waited = guard.acquire()
+        if waited > 1:
+            logger.info(f"Throttled {waited:.1f}s before calling {endpoint}")
+        tracing.annotate(throttled_s=round(waited, 3))
+
+        entry = self._lease
+        own_lease = entry is None and self.cookie_pool is not None
+        if own_lease:
+            entry = self.cookie_pool.acquire()
+        start = time.monotonic()
+        try:
+            response = self.session.get(api_url, params=params, cookies=entry.cookies if entry else None)
+            tracing.annotate(http_status=response.status_code)
+            overloaded = response.status_code == 429 or response.status_code >= 500
+            data = response.json()
+        except Exception:
+            guard.record(False, time.monotonic() - start)
+            if entry:
+                self.cookie_pool.report(entry, -1)
+            raise
+        finally:
+            if own_lease:
+                self.cookie_pool.release(entry)
+        # Only the endpoint's own distress slows it down or trips the breaker; other
+        # non-zero codes (bad link, no permission, expired cookie) are per-request
+        # problems, and cookie failures are handled by the pool below
+        healthy = not overloaded and data.get('code') not in config.API_THROTTLE_CODES
+        guard.record(healthy, time.monotonic() - start)
+        tracing.annotate(code=data.get('code'))
+        # Likewise only auth/expiry codes count against the cookie: a bad link, a removed
+        # recording or a missing permission would otherwise sideline a healthy cookie
+        if entry and (data.get('code') == 0 or data.get('code') in config.COOKIE_FAILURE_CODES):
+            self.cookie_pool.report(entry, data.get('code'))
+        return data
+
+    @tracing.traced("fetch_recording_info")
     def fetch_recording_info(self):
         """
         Fetch recording info from API.
         Returns API data, or falls back to page_recordings if API returns empty.
         """
+        if self.metadata_cache is not None and self.collection_uuid in self.metadata_cache:
+            logger.info(f"Using cached recording info for {self.collection_uuid}")
+            self.recording_info = self.metadata_cache[self.collection_uuid]
+            return self.recording_info
+
         nonce = self.generate_nonce()
         timestamp = int(time.time() * 1000)
         trace_id = self.generate_trace_id()
@@ -180,14 +313,15 @@ class TencentMeetingDownloader:
             "trace-id": trace_id
         }
 
-        response = self.session.get(api_url, params=params)
-        data = response.json()
+        data = self._api_get('record_info', api_url, params)
 
         if data.get('code') != 0:
             logger.error(f"Error fetching record info: {data.get('message', 'Unknown error')}")
             return None
 
         self.recording_info = data.get('data', {})
+        if self.metadata_cache is not None:
+            self.metadata_cache[self.collection_uuid] = self.recording_info
 
         # Check if API returned empty, use page_recordings as fallback
         base_infos = self.recording_info.get('base_infos') or self.recording_info.get('record_info_list')
@@ -208,6 +342,7 @@ class TencentMeetingDownloader:
 
         return self.recording_info
 
+    @tracing.traced("fetch_sign_urls")
     def fetch_sign_urls(self, record_uuid):
         """
         Fetch signed URLs for a recording.
@@ -227,8 +362,7 @@ class TencentMeetingDownloader:
             "c_lang": "zh-CN", "trace-id": trace_id
         }
 
-        response = self.session.get(api_url, params=params)
-        data = response.json()
+        data = self._api_get('sign', api_url, params)
         if data.get('code') != 0:
             logger.error(f"Sign API Status: Code={data.get('code')}, Msg={data.get('message')}")
         return data
@@ -267,6 +401,41 @@ class TencentMeetingDownloader:
 
         return None, None
 
+    def _record_uuid(self, record):
+        """
+        UUID to pass to the sign API for a base_infos entry.
+        Priority: sharing_id from record > mapped UUID > rec_id
+        """
+        rec_id = record.get('recording_id') or record.get('record_id') or record.get('id')
+        if record.get('sharing_id'):
+            return record['sharing_id']
+        if rec_id and str(rec_id) in self.record_mappings:
+            return self.record_mappings[str(rec_id)]
+        return rec_id
+
+    @_cookie_job
+    def fetch_stream_url(self, url, key, stream_label):
+        """
+        Freshly signed download URL for the recording with `recording_key` `key`
+        in the collection at `url`, for the stream that was originally downloaded.
+        Used to repair files after the original signed URL has expired.
+        """
+        self.resolve_ids(self.extract_short_id(url))
+        info = self.fetch_recording_info()
+        if not info:
+            raise Exception("Could not fetch recording info. Cookie might be invalid.")
+        base_infos = info.get('base_infos') or info.get('record_info_list') or []
+        record = next((r for r in base_infos if recording_key(r) == key), None)
+        if record is None:
+            raise Exception(f"Recording {key} is no longer in the collection")
+        sign_data = self.fetch_sign_urls(self._record_uuid(record))
+        stream_url, label = self._get_download_url_from_sign_data(sign_data)
+        if not stream_url:
+            raise Exception(f"Could not sign recording {key}: {sign_data.get('message')}")
+        if label != stream_label:
+            raise Exception(f"Recording {key} is now offered as {label}, not {stream_label}")
+        return stream_url
+
     def start_download(self, url, progress_callback=None):
         """
         Main entry point for bot. Returns the local filename if successful.
@@ -277,12 +446,30 @@ class TencentMeetingDownloader:
             return filenames[0]
         raise Exception("Download failed - no files downloaded.")
 
-    def download_all(self, url, max_count=None, progress_callback=None):
+    @_cookie_job
+    def download_all(self, url, max_count=None, progress_callback=None, output_dir=None,
+                     quiet=False, skip=None, on_file=None, throttle=None, only=None, write_manifest=False):
         """
         Download all (or up to max_count) recordings from the URL.
+        Files are written to `output_dir` (default: current directory).
+        `progress_callback` receives progress events from every stage
+        (see progress.ProgressTracker); `quiet` hides the tqdm bars;
+        `throttle` (see bandwidth.JobThrottle) shapes the download rate.
+        Recording indices (0-based) in `skip` are not downloaded, and
+        `on_file(idx, filename, key)` is called after each successful download
+        (`key` is the recording's `recording_key`).
+        With `only`, recordings whose `recording_key` is not in it are skipped.
+        With `write_manifest`, each file gets an integrity sidecar (see manifest.py).
         Returns list of downloaded filenames.
         """
+        def report(event):
+            if progress_callback:
+                progress_callback(event)
+
+        from downloader import download_file, download_hls
+
         try:
+            report({'stage': 'resolving'})
             short_id = self.extract_short_id(url)
             self.resolve_ids(short_id)
             info = self.fetch_recording_info()
@@ -301,22 +488,16 @@ class TencentMeetingDownloader:
             downloaded_files = []
 
             for idx, record in enumerate(base_infos):
+                if skip and idx in skip:
+                    logger.info(f"Skipping recording {idx + 1}/{len(base_infos)} (already downloaded)")
+                    continue
+                if only is not None and recording_key(record) not in only:
+                    continue
                 logger.info(f"Processing recording {idx + 1}/{len(base_infos)}")
+                report({'stage': 'signing', 'recording': idx + 1, 'recordings': len(base_infos)})
 
-                # Get record identifiers
-                rec_id = record.get('recording_id') or record.get('record_id') or record.get('id')
-                sharing_id = record.get('sharing_id')
                 topic = record.get('name') or record.get('meeting_topic') or f'Recording_{idx + 1}'
-
-                # Determine which UUID to use for sign API
-                # Priority: sharing_id from record > mapped UUID > rec_id
-                if sharing_id:
-                    record_uuid = sharing_id
-                elif rec_id and str(rec_id) in self.record_mappings:
-                    record_uuid = self.record_mappings[str(rec_id)]
-                else:
-                    record_uuid = rec_id
-
+                record_uuid = self._record_uuid(record)
                 if not record_uuid:
                     logger.warning(f"Could not determine UUID for recording {idx + 1}, skipping.")
                     continue
@@ -335,28 +516,37 @@ class TencentMeetingDownloader:
                     logger.error(f"No download URL available for recording {idx + 1}")
                     continue
 
-                # Generate filename
-                safe_topic = "".join([c for c in topic if c.isalnum() or c in (' ', '_', '-')]).strip()
-                if not safe_topic:
-                    safe_topic = f"Recording_{idx + 1}"
-
-                # Add index if multiple recordings
-                if len(base_infos) > 1:
-                    filename = f"{safe_topic}_{idx + 1}_{stream_label}.mp4"
-                else:
-                    filename = f"{safe_topic}_{stream_label}.mp4"
+                filename = recording_filename(topic, idx, len(base_infos), stream_label)
+                if output_dir:
+                    filename = os.path.join(output_dir, filename)
 
                 logger.info(f"Starting download: {filename}")
 
                 # Download based on URL type
                 try:
-                    if ".m3u8" in stream_url:
-                        success = download_hls(stream_url, filename, headers=dict(self.session.headers))
-                    else:
-                        success = download_file(stream_url, filename, headers=dict(self.session.headers))
-
+                    pieces = {} if write_manifest else None
+                    transfer_args = dict(
+                        headers=dict(self.session.headers), session=self.transfer_session,
+                        progress=progress_callback, quiet=quiet, throttle=throttle, manifest=pieces,
+                    )
+                    with tracing.span("download", recording=idx + 1, stream=stream_label,
+                                      hls=".m3u8" in stream_url) as download_span:
+                        if ".m3u8" in stream_url:
+                            success = download_hls(stream_url, filename, **transfer_args)
+                        else:
+                            success = download_file(stream_url, filename, **transfer_args)
+                        download_span.set(success=success)
+
+                    if success and write_manifest:
+                        import manifest
+                        manifest.write(
+                            filename, pieces, stream=stream_label, duration_ms=record.get('duration'),
+                            source={'url': url, 'recording': recording_key(record), 'stream': stream_label},
+                        )
                     if success:
                         downloaded_files.append(filename)
+                        if on_file:
+                            on_file(idx, filename, recording_key(record))
                         logger.info(f"Successfully downloaded: {filename}")
                     else:
                         logger.error(f"Download failed for: {filename}")
@@ -369,6 +559,7 @@ class TencentMeetingDownloader:
             logger.exception("Error during download process")
             raise e
 
+    @_cookie_job
     def get_recording_list(self, url):
         """
         Get list of recordings without downloading.
@@ -382,56 +573,73 @@ class TencentMeetingDownloader:
             return []
 
         base_infos = info.get('base_infos') or info.get('record_info_list') or []
-
-        result = []
-        for idx, record in enumerate(base_infos):
-            duration = record.get('duration')
-            size = record.get('size')
-            # Ensure numeric types
-            if duration and isinstance(duration, str):
-                duration = int(duration)
-            if size and isinstance(size, str):
-                size = int(size)
-            result.append({
-                'index': idx + 1,
-                'name': record.get('name') or record.get('meeting_topic') or f'Recording_{idx + 1}',
-                'duration': duration,
-                'size': size,
-                'sharing_id': record.get('sharing_id'),
-            })
-
-        return result
+        return normalize_recordings(base_infos)
+
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Download Tencent Meeting recordings.",
+        epilog="Examples:\n"
+               "  python main.py <URL> [COOKIE]\n"
+               "  python main.py --all <URL> [COOKIE]\n"
+               "  python main.py --batch urls.txt --jobs 4 --out archive/\n"
+               "  python main.py --verify archive/ [--repair]",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("url", nargs="?", help="Recording URL")
+    parser.add_argument("cookie", nargs="?", help="Tencent Meeting cookie string")
+    parser.add_argument("--all", action="store_true", help="Download all recordings from the URL")
+    parser.add_argument("--cookie", dest="cookie_opt", metavar="COOKIE", help="Cookie string (alternative to the positional argument)")
+    parser.add_argument("--batch", metavar="FILE", help="File with one URL per line to download in batch mode")
+    parser.add_argument("--jobs", type=int, default=4, help="Concurrent downloads in batch mode, or files checked at once with --verify (default: 4)")
+    parser.add_argument("--out", default=".", help="Output directory (default: current directory)")
+    parser.add_argument("--report", help="JSONL report path for batch mode (default: <out>/batch_report.jsonl)")
+    parser.add_argument("--first-only", action="store_true",
+                        help="Batch mode: download only the first recording of each URL")
+    parser.add_argument("--verify", nargs="+", metavar="PATH",
+                        help="Check downloaded files (or directories of them) against their manifests")
+    parser.add_argument("--repair", action="store_true",
+                        help="With --verify: re-fetch only the damaged pieces of each file")
+    args = parser.parse_args(argv)
+    if not args.url and not args.batch and not args.verify:
+        parser.error("URL is required")
+    return args
 
 
 if __name__ == "__main__":
-    # Compatibility with old CLI if needed
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <URL> [COOKIE]")
-        print("       python main.py --all <URL> [COOKIE]  # Download all recordings")
-    else:
-        download_all = False
-        url_idx = 1
-
-        if sys.argv[1] == "--all":
-            download_all = True
-            url_idx = 2
-
-        if url_idx >= len(sys.argv):
-            print("Error: URL is required")
-            sys.exit(1)
-
-        url = sys.argv[url_idx]
-        cookie = sys.argv[url_idx + 1] if len(sys.argv) > url_idx + 1 else None
-
-        dl = TencentMeetingDownloader(cookie)
-        try:
-            if download_all:
-                paths = dl.download_all(url)
-                print(f"Downloaded {len(paths)} files:")
-                for p in paths:
-                    print(f"  - {p}")
-            else:
-                path = dl.start_download(url)
-                print(f"Downloaded to: {path}")
-        except Exception as e:
-            print(f"Error: {e}")
+    args = parse_args()
+    cookie = args.cookie_opt or args.cookie
+
+    if args.verify:
+        from verify import run_verify
+        results = run_verify(args.verify, jobs=args.jobs, cookie=cookie, repair=args.repair)
+        sys.exit(0 if all(r['status'] in ('ok', 'repaired') for r in results) else 1)
+
+    if args.batch:
+        from batch import read_urls, run_batch
+        records = run_batch(
+            read_urls(args.batch), jobs=args.jobs, out_dir=args.out, cookie=cookie,
+            report_path=args.report, download_all=not args.first_only,
+        )
+        ok = sum(1 for r in records if r['status'] == 'ok')
+        print(f"Batch finished: {ok}/{len(records)} URLs downloaded")
+        sys.exit(0 if all(r['status'] in ('ok', 'duplicate') for r in records) else 1)
+
+    if args.out != ".":
+        os.makedirs(args.out, exist_ok=True)
+
+    dl = TencentMeetingDownloader(cookie)
+    try:
+        if args.all:
+            paths = dl.download_all(args.url, output_dir=args.out, write_manifest=True)
+            print(f"Downloaded {len(paths)} files:")
+            for p in paths:
+                print(f"  - {p}")
+        else:
+            paths = dl.download_all(args.url, max_count=1, output_dir=args.out, write_manifest=True)
+            if not paths:
+                raise Exception("Download failed - no files downloaded.")
+            print(f"Downloaded to: {paths[0]}")
+    except Exception as e:
+        print(f"Error: {e}")
@@ -0,0 +1,124 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+
+# Sidecar written next to each archived download: <file>.manifest.json
+#   {'version': 1, 'file': 'Topic_Direct.mp4', 'size': 123, 'kind': 'direct',
+#    'pieces': [{'offset': 0, 'length': 8388608, 'blake2b': '...'}, ...],
+#    'stream': 'Direct', 'duration_ms': 3600000,
+#    'source': {'url': ..., 'recording': <main.recording_key>, 'stream': 'Direct'}, 'created_at': ...}
+# kind is 'direct' (pieces are byte ranges), 'hls' (pieces are segments, with an
+# 'index') or 'hls-remux' (fixed-size pieces of the ffmpeg output).
+SUFFIX = ".manifest.json"
+VERSION = 1
+
+def path_for(filename):
+    return filename + SUFFIX
+
+def new_hash(data=b""):
+    return hashlib.blake2b(data, digest_size=16)
+
+class PieceHasher:
+    """
+    Hashes a sequentially written stream as consecutive pieces of `piece_size`
+    bytes as it is written, so no second pass over the file is needed.
+    """
+
+    def __init__(self, piece_size, offset=0):
+        self.piece_size = piece_size
+        self.offset = offset
+        self.pieces = []
+        self._hash = new_hash()
+        self._length = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while data:
+            take = min(len(data), self.piece_size - self._length)
+            self._hash.update(data[:take])
+            self._length += take
+            data = data[take:]
+            if self._length == self.piece_size:
+                self._finish()
+
+    def _finish(self):
+        self.pieces.append({'offset': self.offset, 'length': self._length, 'blake2b': self._hash.hexdigest()})
+        self.offset += self._length
+        self._hash = new_hash()
+        self._length = 0
+
+    def close(self):
+        """Finish the last partial piece and return all pieces."""
+        if self._length:
+            self._finish()
+        return self.pieces
+
+def hash_file(filename, piece_size):
+    """Pieces of an existing file (for outputs written by ffmpeg rather than by us)."""
+    hasher = PieceHasher(piece_size)
+    buf = bytearray(1024 * 1024)
+    view = memoryview(buf)
+    with open(filename, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return hasher.close()
+
+def write(filename, info, **fields):
+    """Write the sidecar for `filename` from the engine's `info` (kind, pieces) and extra `fields`."""
+    data = {
+        'version': VERSION,
+        'file': os.path.basename(filename),
+        'size': os.path.getsize(filename),
+        'kind': info['kind'],
+        'pieces': info['pieces'],
+        **fields,
+        'created_at': time.time(),
+    }
+    tmp = path_for(filename) + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path_for(filename))
+    return data
+
+def load(filename):
+    with open(path_for(filename), encoding='utf-8') as f:
+        return json.load(f)
+
+def verify_file(filename):
+    """
+    Check `filename` against its sidecar. Returns a dict with `status`
+    ('ok', 'missing', 'no_manifest', 'damaged'), the manifest and the list of
+    `bad` pieces. A file of the wrong size is damaged from the first piece
+    that no longer fits or matches.
+    """
+    result = {'file': filename, 'status': 'ok', 'manifest': None, 'bad': []}
+    if not os.path.exists(path_for(filename)):
+        result['status'] = 'no_manifest'
+        return result
+    result['manifest'] = data = load(filename)
+    if not os.path.exists(filename):
+        result['status'] = 'missing'
+        result['bad'] = list(data['pieces'])
+        return result
+
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        try:
+            view = memoryview(mapped) if mapped else memoryview(b"")
+            for piece in data['pieces']:
+                end = piece['offset'] + piece['length']
+                if end > size or new_hash(view[piece['offset']:end]).hexdigest() != piece['blake2b']:
+                    result['bad'].append(piece)
+            view.release()
+        finally:
+            if mapped:
+                mapped.close()
+    if result['bad'] or size != data['size']:
+        result['status'] = 'damaged'
+    return result
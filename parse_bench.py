@@ -0,0 +1,169 @@
+"""
+CPU and memory benchmark for page parsing and sign-response handling.
+
+Runs on synthetic landing pages with 1 to 500 recordings, with serverData both
+as a plain object and as an escaped JSON string, and on large sign responses:
+  - page:      TencentMeetingDownloader._parse_page (resolve_ids without the request)
+  - extract:   _extract_page_recordings alone (the per-sharing_id scans)
+  - filenames: recording_filename for every recording
+  - normalize: normalize_recordings (get_recording_list without the requests)
+  - sign:      decoding a sign response and picking the stream URL
+Each case reports the best per-call time (timeit) and peak traced memory
+(tracemalloc), and is compared with parse_bench_thresholds.json.
+
+Usage: python parse_bench.py [--sizes 1,10,100,500] [--repeat N] [--record]
+`--record` rewrites the thresholds from this run (time x TIME_MARGIN,
+memory x MEMORY_MARGIN). Exits non-zero if a threshold is exceeded.
+"""
+import os
+import sys
+import json
+import uuid
+import random
+import timeit
+import logging
+import argparse
+import tracemalloc
+
+from main import TencentMeetingDownloader, recording_filename, normalize_recordings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+THRESHOLDS = os.path.join(HERE, "parse_bench_thresholds.json")
+# Recorded thresholds leave room for slower machines and noisy CI runners
+TIME_MARGIN = 3.0
+MEMORY_MARGIN = 1.5
+
+TOPICS = ["Weekly sync", "周会 / 项目复盘", "Q&A: roadmap (draft)", "", "Design review #12 — 设计评审"]
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+def make_records(n, rng):
+    records = []
+    for i in range(n):
+        record = {
+            'sharing_id': _uuid(rng),
+            'id': str(rng.randrange(10 ** 18, 10 ** 19)),
+            'name': f"{TOPICS[i % len(TOPICS)]} {i + 1}",
+            'duration': str(rng.randrange(60_000, 7_200_000)),
+            'size': str(rng.randrange(10 ** 6, 10 ** 10)),
+            'cover_url': f"https://cdn.example.com/cover/{_uuid(rng)}.jpg?sign={'a' * 120}",
+            'create_time': str(1_700_000_000_000 + i * 86_400_000),
+        }
+        if i % 2:
+            # Real pages list the fields in both orders
+            record = {'id': record.pop('id'), **record}
+        records.append(record)
+    return records
+
+def make_page(n, escaped, seed=0):
+    """Landing page HTML with `n` recordings in serverData, plus unrelated script around it."""
+    rng = random.Random(seed)
+    collection = _uuid(rng)
+    server_data = {
+        'collection': {'id': collection, 'name': "Recurring meeting", 'records': make_records(n, rng)},
+        'user': {'nick_name': "viewer", 'avatar': "https://cdn.example.com/avatar.png"},
+    }
+    body = json.dumps(server_data, ensure_ascii=False)
+    if escaped:
+        script = f'window.__SERVER_DATA__ = JSON.parse("{json.dumps(body, ensure_ascii=False)[1:-1]}");'
+    else:
+        script = f"window.__SERVER_DATA__ = {body};"
+    filler = "function f(a,b){return a.map(function(x){return x+b})};\n" * 2000
+    return (
+        f'<html><head><meta property="og:url" content="https://meeting.tencent.com/cw/abc?id={collection}">'
+        f"<script>{filler}</script></head><body><div id=\"app\"></div><script>{script}</script></body></html>"
+    )
+
+def make_sign_response(streams):
+    rng = random.Random(streams)
+    data = {
+        'multi_stream_recordings': [
+            {
+                'stream_type': 3 if i < streams - 1 else 1,
+                'sign_url': f"https://cdn.example.com/hls/{_uuid(rng)}/index.m3u8?sign={'b' * 1500}",
+                'file_size': str(rng.randrange(10 ** 6, 10 ** 10)),
+            }
+            for i in range(streams)
+        ],
+    }
+    return json.dumps({'code': 0, 'data': data, 'signurl': None})
+
+def cases(sizes):
+    """(name, callable) pairs; each callable does one unit of work."""
+    dl = TencentMeetingDownloader()
+    for n in sizes:
+        records = make_records(n, random.Random(n))
+        for escaped in (False, True):
+            form = "escaped" if escaped else "plain"
+            page = make_page(n, escaped)
+            dl._parse_page(page, "abc")
+            if len(dl.page_recordings) != n:
+                raise SystemExit(f"{form} page with {n} recordings parsed as {len(dl.page_recordings)}")
+            yield f"page/{form}/{n}", lambda page=page: dl._parse_page(page, "abc")
+            yield f"extract/{form}/{n}", lambda page=page: dl._extract_page_recordings(page)
+        yield f"filenames/{n}", lambda records=records: [
+            recording_filename(r['name'], i, len(records), "ScreenShare") for i, r in enumerate(records)
+        ]
+        yield f"normalize/{n}", lambda records=records: normalize_recordings(records)
+        body = make_sign_response(n)
+        yield f"sign/{n}", lambda body=body: dl._get_download_url_from_sign_data(json.loads(body))
+
+def measure(fn, repeat):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000, peak / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Page parsing / sign response benchmark")
+    parser.add_argument("--sizes", default="1,10,100,500", help="Recording counts (default: 1,10,100,500)")
+    parser.add_argument("--repeat", type=int, default=5, help="timeit repeats (best is reported)")
+    parser.add_argument("--record", action="store_true", help=f"Rewrite {os.path.basename(THRESHOLDS)}")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    # The parsers log every page at INFO
+    logging.disable(logging.INFO)
+    thresholds = {}
+    if os.path.exists(THRESHOLDS):
+        with open(THRESHOLDS, encoding="utf-8") as f:
+            thresholds = json.load(f)
+
+    results = {}
+    failed = False
+    print(f"{'case':<22} {'time':>10} {'limit':>10} {'peak':>10} {'limit':>10}")
+    for name, fn in cases(sizes):
+        ms, kb = measure(fn, args.repeat)
+        results[name] = {'ms': ms, 'peak_kb': kb}
+        limit = thresholds.get(name)
+        status = ""
+        if limit and not args.record:
+            over = [what for what, value in (('time', ms), ('memory', kb))
+                    if value > limit['ms' if what == 'time' else 'peak_kb']]
+            if over:
+                failed = True
+                status = "REGRESSION (" + ", ".join(over) + ")"
+        print(
+            f"{name:<22} {ms:>8.3f}ms {limit['ms'] if limit else float('nan'):>8.3f}ms "
+            f"{kb:>8.0f}KB {limit['peak_kb'] if limit else float('nan'):>8.0f}KB {status}"
+        )
+
+    if args.record:
+        recorded = {
+            name: {'ms': round(r['ms'] * TIME_MARGIN, 3), 'peak_kb': round(r['peak_kb'] * MEMORY_MARGIN, 1)}
+            for name, r in results.items()
+        }
+        with open(THRESHOLDS, "w", encoding="utf-8") as f:
+            json.dump(dict(thresholds, **recorded), f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nThresholds written to {os.path.basename(THRESHOLDS)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
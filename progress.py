@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger("Progress")
+
+# Rate is averaged over this many seconds of samples
+RATE_WINDOW = 10
+
+class ProgressTracker:
+    """
+    Thread-safe progress state for one job.
+    Pass an instance as `progress_callback`: the download engines call it from
+    worker threads with event dicts such as
+        {'stage': 'downloading', 'recording': 1, 'recordings': 3}
+        {'bytes': 65536, 'segments_done': 12}
+        {'bytes_total': 104857600} / {'segments_total': 240}
+    Events are merged into the current state; readers take `snapshot()`s.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._samples = deque()
+        self.version = 0
+        self.stage = "starting"
+        self.recording = None
+        self.recordings = None
+        self._reset_file()
+
+    def _reset_file(self):
+        self.bytes_done = 0
+        self.bytes_total = None
+        self.segments_done = 0
+        self.segments_total = None
+        self._file_started = time.monotonic()
+        self._samples.clear()
+
+    def __call__(self, event):
+        now = time.monotonic()
+        with self._lock:
+            if 'recording' in event and event['recording'] != self.recording:
+                self._reset_file()
+            for key in ('stage', 'recording', 'recordings', 'bytes_total', 'segments_total', 'segments_done'):
+                if key in event:
+                    setattr(self, key, event[key])
+            if event.get('bytes'):
+                self.bytes_done += event['bytes']
+                self._samples.append((now, self.bytes_done))
+                while self._samples and now - self._samples[0][0] > RATE_WINDOW:
+                    self._samples.popleft()
+            self.version += 1
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            rate = None
+            if len(self._samples) > 1:
+                (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+                if t1 > t0:
+                    rate = (b1 - b0) / (t1 - t0)
+
+            eta = None
+            if self.bytes_total and rate:
+                eta = max(0, self.bytes_total - self.bytes_done) / rate
+            elif self.segments_total and self.segments_done:
+                elapsed = now - self._file_started
+                eta = elapsed / self.segments_done * (self.segments_total - self.segments_done)
+
+            return {
+                'stage': self.stage,
+                'recording': self.recording,
+                'recordings': self.recordings,
+                'bytes_done': self.bytes_done,
+                'bytes_total': self.bytes_total,
+                'segments_done': self.segments_done,
+                'segments_total': self.segments_total,
+                'rate': rate,
+                'eta': eta,
+                'elapsed': now - self._started,
+            }
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+def format_progress(snapshot):
+    """Render a tracker snapshot as a status message."""
+    prefix = ""
+    if snapshot['recordings'] and snapshot['recordings'] > 1:
+        prefix = f"[{snapshot['recording']}/{snapshot['recordings']}] "
+
+    if snapshot['stage'] != 'downloading':
+        return f"⏳ {prefix}{snapshot['stage'].capitalize()}..."
+
+    mb_done = snapshot['bytes_done'] / (1024 * 1024)
+    if snapshot['bytes_total']:
+        percentage = snapshot['bytes_done'] / snapshot['bytes_total'] * 100
+        line = f"{percentage:.1f}% ({mb_done:.1f}MB / {snapshot['bytes_total'] / (1024 * 1024):.1f}MB)"
+    elif snapshot['segments_total']:
+        percentage = snapshot['segments_done'] / snapshot['segments_total'] * 100
+        line = (f"{percentage:.1f}% ({snapshot['segments_done']}/{snapshot['segments_total']} segments, "
+                f"{mb_done:.1f}MB)")
+    else:
+        line = f"{mb_done:.1f}MB"
+
+    msg = f"⏳ {prefix}Downloading: {line}"
+    if snapshot['rate']:
+        msg += f"\n📶 {snapshot['rate'] / (1024 * 1024):.2f}MB/s"
+    if snapshot['eta'] is not None:
+        msg += f" · ETA {_format_duration(snapshot['eta'])}"
+    return msg
+
+async def report_progress(tracker, edit, interval=5):
+    """
+    Coalesce tracker events into at most one `await edit(text)` per `interval`
+    seconds, and only when something changed. Runs until cancelled.
+    """
+    last_version = None
+    last_text = None
+    while True:
+        await asyncio.sleep(interval)
+        if tracker.version == last_version:
+            continue
+        last_version = tracker.version
+        text = format_progress(tracker.snapshot())
+        if text == last_text:
+            continue
+        try:
+            await edit(text)
+            last_text = text
+        except Exception as e:
+            # Rate limits or "message not modified" must never break the download
+            logger.debug(f"Progress edit failed: {e}")
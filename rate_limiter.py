@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("RateLimiter")
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts to the API's health (AIMD):
+    every healthy response adds `increase` requests/s, every error or slow
+    response multiplies the rate by `decrease`.
+    """
+
+    def __init__(self, rate=2.0, burst=4, min_rate=0.2, max_rate=10.0,
+                 increase=0.1, decrease=0.5, slow_threshold=3.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_threshold = slow_threshold
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a token is available. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def record(self, ok, latency):
+        with self._lock:
+            if ok and latency < self.slow_threshold:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            else:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, callers
+    wait (rather than fail) until `reset_timeout` has passed, then a single
+    probe request is let through; its result closes or re-opens the circuit.
+    The timeout doubles on every failed probe, up to `max_reset_timeout`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, max_reset_timeout=300):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._cond = threading.Condition()
+
+    def wait(self):
+        """Block while the circuit is open. Returns the seconds spent waiting."""
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                if self.state == self.CLOSED:
+                    break
+                if self.state == self.OPEN:
+                    remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                    if remaining <= 0:
+                        # This caller becomes the probe
+                        self.state = self.HALF_OPEN
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    # A probe is in flight; wait for its verdict
+                    self._cond.wait()
+        return time.monotonic() - start
+
+    def record(self, ok):
+        with self._cond:
+            if ok:
+                if self.state != self.CLOSED:
+                    logger.info("API healthy again, closing circuit.")
+                self.state = self.CLOSED
+                self._failures = 0
+                self.reset_timeout = self.base_reset_timeout
+            else:
+                self._failures += 1
+                if self.state == self.HALF_OPEN:
+                    self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+                    self._open()
+                elif self.state == self.CLOSED and self._failures >= self.failure_threshold:
+                    self._open()
+            self._cond.notify_all()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        logger.warning(f"API unhealthy, pausing requests for {self.reset_timeout}s.")
+
+class EndpointGuard:
+    """Rate limiter + circuit breaker + metrics for one API endpoint."""
+
+    def __init__(self, name, rate=2.0, burst=4):
+        self.name = name
+        self.limiter = AdaptiveRateLimiter(rate=rate, burst=burst)
+        self.breaker = CircuitBreaker()
+        self.requests = 0
+        self.errors = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for the circuit to close and for a token. Call before every request."""
+        waited = self.breaker.wait()
+        waited += self.limiter.acquire()
+        with self._lock:
+            self.requests += 1
+            self.throttled_seconds += waited
+        return waited
+
+    def record(self, ok, latency):
+        """Report the outcome of a request made after `acquire()`."""
+        self.limiter.record(ok, latency)
+        self.breaker.record(ok)
+        if not ok:
+            with self._lock:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'endpoint': self.name,
+                'requests': self.requests,
+                'errors': self.errors,
+                'throttled_seconds': round(self.throttled_seconds, 2),
+                'rate': round(self.limiter.rate, 2),
+                'circuit': self.breaker.state,
+            }
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+def get_guard(name, rate=2.0, burst=4):
+    """Return the process-wide guard for endpoint `name`, creating it on first use."""
+    with _guards_lock:
+        if name not in _guards:
+            _guards[name] = EndpointGuard(name, rate=rate, burst=burst)
+        return _guards[name]
+
+def snapshot():
+    """Metrics for every endpoint seen so far."""
+    with _guards_lock:
+        guards = list(_guards.values())
+    return [g.snapshot() for g in guards]
+
+def format_stats():
+    """Render the endpoint metrics as a chat message."""
+    stats = snapshot()
+    if not stats:
+        return "📊 No API requests yet."
+    msg = "📊 API endpoints:\n\n"
+    for s in stats:
+        msg += (
+            f"{s['endpoint']} ({s['circuit']})\n"
+            f"   rate: {s['rate']}/s, requests: {s['requests']}, errors: {s['errors']}\n"
+            f"   throttled: {s['throttled_seconds']}s\n"
+        )
+    return msg
@@ -0,0 +1,16 @@
+import time
+import logging
+
+logger = logging.getLogger("Startup")
+
+# Imported first by bot.py, so this is (close to) process start
+STARTED_AT = time.monotonic()
+first_message_latency = None
+
+def mark_first_message():
+    """Record and log the time from process start to the first handled message (once)."""
+    global first_message_latency
+    if first_message_latency is not None:
+        return
+    first_message_latency = time.monotonic() - STARTED_AT
+    logger.info(f"Time to first handled message: {first_message_latency:.2f}s")
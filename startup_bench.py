@@ -0,0 +1,101 @@
+"""
+Startup benchmark and import-time budget check.
+
+Measures, in fresh interpreters:
+  - `python main.py --help`
+  - importing the entry point for each RUN_MODE (bot_mode / client_mode)
+and uses `-X importtime` to check that the CLI import path stays within budget
+and does not pull in heavy modules before they are needed.
+
+Usage: python startup_bench.py [--runs N] [--budget-ms MS]
+Exits non-zero if a budget is exceeded or a deferred module is imported eagerly.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not be imported just to run `main.py --help` or `import main`
+DEFERRED_MODULES = ["requests", "tqdm", "m3u8", "Crypto", "downloader", "telegram", "telethon"]
+
+def _env():
+    env = dict(os.environ)
+    # Keep the mode modules' side effects (job DB, download dir) out of the repo
+    tmp = tempfile.mkdtemp(prefix="startup_bench_")
+    env["JOB_DB_PATH"] = os.path.join(tmp, "jobs.db")
+    env["DOWNLOAD_DIR"] = os.path.join(tmp, "downloads")
+    return env
+
+def time_command(args, runs, env):
+    """Median wall time (ms) of running `python <args>` in a fresh interpreter."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable] + args, cwd=HERE, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        samples.append((time.perf_counter() - start) * 1000)
+        if result.returncode != 0:
+            return None, result.stderr.decode(errors="replace").strip().splitlines()[-1:]
+    return statistics.median(samples), None
+
+def import_times(module, env):
+    """Parse `-X importtime` output into {module: cumulative microseconds}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    times = {}
+    for line in result.stderr.decode(errors="replace").splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark and import budget check")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement (median is reported)")
+    parser.add_argument("--budget-ms", type=float, default=30,
+                        help="Budget for the cumulative import time of `main` (default: 30ms)")
+    args = parser.parse_args()
+    env = _env()
+    failed = False
+
+    print("== Import budget (-X importtime) ==")
+    times = import_times("main", env)
+    main_ms = times.get("main", 0) / 1000
+    status = "OK" if main_ms <= args.budget_ms else "OVER BUDGET"
+    failed |= main_ms > args.budget_ms
+    print(f"import main: {main_ms:.1f}ms (budget {args.budget_ms:.0f}ms) {status}")
+    eager = [m for m in DEFERRED_MODULES if m in times]
+    if eager:
+        failed = True
+        print(f"Deferred modules imported eagerly: {', '.join(eager)}")
+    top = sorted(((t, m) for m, t in times.items() if "." not in m), reverse=True)[:10]
+    for t, m in top:
+        print(f"  {t / 1000:8.1f}ms  {m}")
+
+    print(f"\n== Startup wall time (median of {args.runs}) ==")
+    commands = [
+        ("main.py --help", ["main.py", "--help"]),
+        ("RUN_MODE=BOT (import bot_mode)", ["-c", "import bot_mode"]),
+        ("RUN_MODE=CLIENT (import client_mode)", ["-c", "import client_mode"]),
+    ]
+    for label, command in commands:
+        median, error = time_command(command, args.runs, env)
+        if median is None:
+            failed = True
+            print(f"{label}: failed ({' '.join(error)})")
+        else:
+            print(f"{label}: {median:.0f}ms")
+
+    print("\nTime to first handled message is logged by the bot at runtime "
+          "(\"Time to first handled message: ...\").")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+import config
+
+logger = logging.getLogger("Tracing")
+
+_job = contextvars.ContextVar("trace_job", default=None)
+_span = contextvars.ContextVar("trace_span", default=None)
+
+class Span:
+    __slots__ = ("name", "job", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attrs", "error")
+
+    def __init__(self, name, job, parent, attrs):
+        self.name = name
+        self.job = job
+        self.trace_id = _trace_id(job)
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attrs = attrs
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            'job': self.job,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attrs': self.attrs,
+            'error': self.error,
+        }
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+def _trace_id(job):
+    # OTLP wants 16-byte trace ids; derive a stable one from the job id
+    return hashlib.md5(f"job-{job}".encode()).hexdigest()
+
+# --- EXPORTERS ---
+
+class JsonlExporter:
+    """
+    Appends one JSON line per span to a file kept open for the life of the process.
+    Line buffering writes each span with a single append, so /trace sees it at once
+    and lines from several processes (workers) sharing the file don't interleave.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+        atexit.register(self.close)
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            # Spans still finishing in daemon threads at exit are dropped
+            if not self._file.closed:
+                self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class OtlpExporter:
+    """Batches spans and POSTs them as OTLP/HTTP JSON to a local collector."""
+
+    def __init__(self, endpoint, batch_size=100, interval=5):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._wake = threading.Event()
+        threading.Thread(target=self._loop, args=(interval,), daemon=True, name="otlp-exporter").start()
+        atexit.register(self.flush)
+
+    def export(self, span):
+        with self._lock:
+            self._buffer.append(span)
+            if len(self._buffer) >= self.batch_size:
+                self._wake.set()
+
+    def _loop(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        # Imported here: urllib.request (http.client, ssl, email) is most of this module's import time
+        import urllib.request
+
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+        if not spans:
+            return
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attr('service.name', 'tencent-meeting-bot')]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': [_otlp_span(s) for s in spans]}],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(body, default=str).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST',
+        )
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            logger.warning(f"Failed to export {len(spans)} spans to {self.endpoint}: {e}")
+
+def _otlp_attr(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+def _otlp_span(span):
+    attrs = dict(span.attrs, job=span.job)
+    result = {
+        'traceId': span.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': 1,
+        'startTimeUnixNano': str(span.start_ns),
+        'endTimeUnixNano': str(span.end_ns),
+        'attributes': [_otlp_attr(k, v) for k, v in attrs.items() if v is not None],
+        'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+    }
+    if span.parent_id:
+        result['parentSpanId'] = span.parent_id
+    return result
+
+_exporters = []
+if config.TRACE_FILE:
+    _exporters.append(JsonlExporter(config.TRACE_FILE))
+if config.OTLP_ENDPOINT:
+    _exporters.append(OtlpExporter(config.OTLP_ENDPOINT))
+
+def enabled():
+    return bool(_exporters)
+
+# --- API ---
+
+@contextmanager
+def job_trace(job):
+    """Attribute every span opened inside this block (and bound callables) to `job`."""
+    job_token = _job.set(str(job))
+    span_token = _span.set(None)
+    try:
+        yield
+    finally:
+        _span.reset(span_token)
+        _job.reset(job_token)
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time a block as a span of the current job. Yields an object whose `set(**attrs)`
+    adds attributes; exceptions are recorded and re-raised. A no-op when tracing
+    is disabled or no job is active.
+    """
+    job = _job.get()
+    if not _exporters or job is None:
+        yield _NOOP
+        return
+    current = Span(name, job, _span.get(), attrs)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _span.reset(token)
+        current.end_ns = time.time_ns()
+        for exporter in _exporters:
+            try:
+                exporter.export(current)
+            except Exception as e:
+                logger.warning(f"Span export failed: {e}")
+
+def annotate(**attrs):
+    """Add attributes to the innermost open span, if any."""
+    current = _span.get()
+    if current is not None:
+        current.set(**attrs)
+
+def traced(name):
+    """Decorator form of `span(name)`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def bind(fn):
+    """
+    Wrap `fn` to run in a copy of the current context, so spans it opens in
+    another thread (run_in_executor, thread pools) keep their job and parent.
+    """
+    ctx = contextvars.copy_context()
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+    return wrapper
+
+# --- SUMMARY (/trace) ---
+
+def load_job_spans(job, path=None):
+    path = path or config.TRACE_FILE
+    if not path or not os.path.exists(path):
+        return []
+    job = str(job)
+    spans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if f'"job": "{job}"' not in line:
+                continue
+            record = json.loads(line)
+            if record.get('job') == job:
+                spans.append(record)
+    return spans
+
+def summarize_job(job, path=None):
+    """
+    Render the critical path of a job's trace (at each level, the child that
+    finished last) plus the span names with the most total time.
+    """
+    spans = load_job_spans(job, path)
+    if not spans:
+        return f"No trace found for job {job}."
+
+    children = {}
+    for s in spans:
+        children.setdefault(s['parent_id'], []).append(s)
+    roots = children.get(None, [])
+    start = min(s['start_ns'] for s in spans)
+    end = max(s['end_ns'] for s in spans)
+
+    msg = f"🧭 Job {job}: {len(spans)} spans, {(end - start) / 1e9:.1f}s\n\nCritical path:\n"
+    node = max(roots, key=lambda s: s['end_ns']) if roots else None
+    depth = 0
+    while node is not None:
+        attrs = ", ".join(f"{k}={v}" for k, v in node['attrs'].items() if v is not None)
+        msg += f"{'  ' * depth}• {node['name']} {node['duration_ms'] / 1000:.2f}s"
+        msg += f" ({attrs})\n" if attrs else "\n"
+        kids = children.get(node['span_id'])
+        node = max(kids, key=lambda s: s['end_ns']) if kids else None
+        depth += 1
+
+    totals = {}
+    for s in spans:
+        count, total = totals.get(s['name'], (0, 0.0))
+        totals[s['name']] = (count + 1, total + s['duration_ms'])
+    msg += "\nTime by span:\n"
+    for name, (count, total) in sorted(totals.items(), key=lambda kv: -kv[1][1])[:8]:
+        msg += f"  {name}: {total / 1000:.2f}s ({count}x)\n"
+    return msg
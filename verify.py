@@ -0,0 +1,94 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import manifest
+
+logger = logging.getLogger("Verify")
+
+def find_files(paths):
+    """Files to check: given files, plus every file with a manifest under given directories."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(
+                    os.path.join(root, name[:-len(manifest.SUFFIX)])
+                    for name in sorted(names) if name.endswith(manifest.SUFFIX)
+                )
+        elif path.endswith(manifest.SUFFIX):
+            files.append(path[:-len(manifest.SUFFIX)])
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+def repair_file(result, cookie=None):
+    """
+    Re-fetch the damaged pieces of a verified file with a freshly signed URL.
+    Byte ranges and raw MPEG-TS segments are patched in place; remuxed HLS
+    output cannot be patched, so that recording is downloaded again.
+    """
+    from main import TencentMeetingDownloader
+    import downloader
+
+    filename, data = result['file'], result['manifest']
+    source = data['source']
+    dl = TencentMeetingDownloader(cookie)
+    stream_url = dl.fetch_stream_url(source['url'], source['recording'], source['stream'])
+    headers = dict(dl.session.headers)
+
+    if not os.path.exists(filename):
+        open(filename, 'wb').close()
+    if data['kind'] == 'direct':
+        downloader.repair_ranges(stream_url, filename, result['bad'], data['size'], headers=headers)
+    elif data['kind'] == 'hls':
+        downloader.repair_segments(stream_url, filename, result['bad'], data['size'], headers=headers)
+    else:
+        pieces = {}
+        if not downloader.download_hls(stream_url, filename, headers=headers, quiet=True, manifest=pieces):
+            raise Exception("Re-download failed")
+        fields = {k: v for k, v in data.items() if k in ('stream', 'duration_ms', 'source')}
+        manifest.write(filename, pieces, **fields)
+
+def run_verify(paths, jobs=4, cookie=None, repair=False):
+    """
+    Verify every file in `paths` against its manifest, `jobs` files at a time,
+    optionally repairing damaged ones. Prints one line per file and returns
+    the results (status 'ok', 'repaired', 'damaged', 'missing', 'no_manifest'
+    or 'repair_failed').
+    """
+    files = find_files(paths)
+    if not files:
+        print("No files with manifests found.")
+        return []
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(manifest.verify_file, files))
+
+    for result in results:
+        if repair and result['status'] in ('damaged', 'missing'):
+            try:
+                repair_file(result, cookie)
+                after = manifest.verify_file(result['file'])
+                if after['status'] == 'ok':
+                    result['repaired'] = len(result['bad'])
+                    result['status'] = 'repaired'
+                else:
+                    result['status'] = 'repair_failed'
+                    result['error'] = f"{len(after['bad'])} piece(s) still damaged"
+            except Exception as e:
+                logger.exception(f"Repair failed for {result['file']}")
+                result['status'] = 'repair_failed'
+                result['error'] = str(e)
+
+        line = f"{result['status'].upper():<13} {result['file']}"
+        if result['status'] in ('damaged', 'missing'):
+            line += f" ({len(result['bad'])}/{len(result['manifest']['pieces'])} pieces bad)"
+        elif result['status'] == 'repaired':
+            line += f" ({result['repaired']} piece(s) re-fetched)"
+        elif result.get('error'):
+            line += f" ({result['error']})"
+        print(line)
+
+    ok = sum(1 for r in results if r['status'] in ('ok', 'repaired'))
+    print(f"Verified {len(results)} file(s): {ok} intact")
+    return results
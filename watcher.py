@@ -0,0 +1,125 @@
+import time
+import random
+import asyncio
+import logging
+from main import TencentMeetingDownloader, recording_key
+import config
+
+logger = logging.getLogger("Watcher")
+
+# Interval multipliers after a check that found nothing new / failed
+UNCHANGED_BACKOFF = 1.5
+ERROR_BACKOFF = 2
+# Longest the scheduler sleeps between looking for due watches
+IDLE_SLEEP = 60
+
+def poll_collection(url, collection_uuid=None, cookie_pool=None):
+    """
+    Return (collection_uuid, recording keys) for a collection. With a known
+    `collection_uuid` only the record-info API is called; the landing page is
+    fetched the first time, or when the API returns no recordings.
+    """
+    dl = TencentMeetingDownloader(cookie_pool=cookie_pool)
+    with dl.cookie_lease():
+        return _poll(dl, url, collection_uuid)
+
+def _poll(dl, url, collection_uuid):
+    base_infos = None
+    if collection_uuid:
+        dl.collection_uuid = collection_uuid
+        info = dl.fetch_recording_info()
+        base_infos = info and (info.get('base_infos') or info.get('record_info_list'))
+    if not base_infos:
+        dl.resolve_ids(dl.extract_short_id(url))
+        info = dl.fetch_recording_info()
+        if info is None:
+            raise Exception("Could not fetch recording info. Cookie might be invalid.")
+        base_infos = info.get('base_infos') or info.get('record_info_list') or []
+    return dl.collection_uuid, [key for key in map(recording_key, base_infos) if key]
+
+def _jittered(interval):
+    # Spread checks so that watches added together don't stay in lockstep
+    return time.time() + interval * random.uniform(0.8, 1.2)
+
+class CollectionWatcher:
+    """
+    Periodically checks watched collections (stored in the JobStore) and calls
+    `start_job(watch, keys)` (a coroutine function) with the recordings that
+    were not seen before. `run()` must run as a background task.
+    """
+
+    def __init__(self, store, start_job, cookie_pool=None):
+        self.store = store
+        self.start_job = start_job
+        self.cookie_pool = cookie_pool
+        self._tasks = set()
+
+    async def add(self, url, chat_id):
+        """
+        Watch `url` for `chat_id`. Recordings already in the collection count as
+        seen. Returns (watch_id or None if already watched, number of recordings).
+        """
+        loop = asyncio.get_event_loop()
+        collection_uuid, keys = await loop.run_in_executor(
+            None, poll_collection, url, None, self.cookie_pool
+        )
+        watch_id = self.store.add_watch(
+            url, chat_id, collection_uuid, keys, config.WATCH_INTERVAL,
+            time.time() + random.uniform(0, config.WATCH_INTERVAL),
+        )
+        return watch_id, len(keys)
+
+    async def check(self, watch):
+        loop = asyncio.get_event_loop()
+        try:
+            collection_uuid, keys = await loop.run_in_executor(
+                None, poll_collection, watch['url'], watch['collection_uuid'], self.cookie_pool
+            )
+        except Exception as e:
+            logger.warning(f"Watch {watch['id']} check failed: {e}")
+            interval = min(watch['interval'] * ERROR_BACKOFF, config.WATCH_MAX_INTERVAL)
+            self.store.reschedule_watch(watch['id'], interval, _jittered(interval), error=str(e))
+            return
+
+        seen = self.store.seen_recordings(watch['id'])
+        new = [key for key in keys if key not in seen]
+        if new:
+            interval = config.WATCH_INTERVAL
+        else:
+            interval = min(watch['interval'] * UNCHANGED_BACKOFF, config.WATCH_MAX_INTERVAL)
+        # Marked when the job starts so later checks don't start it again while it runs (or
+        # is resumed after a restart); the job store un-marks whatever the job fails to upload
+        self.store.mark_seen(watch['id'], new)
+        self.store.reschedule_watch(watch['id'], interval, _jittered(interval), collection_uuid)
+        if new:
+            logger.info(f"Watch {watch['id']}: {len(new)} new recording(s) in {watch['url']}")
+            task = asyncio.ensure_future(self.start_job(watch, new))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        while True:
+            try:
+                due = self.store.due_watches(time.time(), config.WATCH_BATCH)
+                if due:
+                    await asyncio.gather(*(self.check(watch) for watch in due))
+                    continue
+                next_check = self.store.next_watch_check()
+            except Exception:
+                logger.exception("Watch scheduler error")
+                next_check = None
+            delay = IDLE_SLEEP if next_check is None else min(max(next_check - time.time(), 1), IDLE_SLEEP)
+            await asyncio.sleep(delay)
+
+def format_watches(watches):
+    if not watches:
+        return "No watched collections. Add one with /watch <URL>"
+    msg = f"👀 Watching {len(watches)} collection(s):\n\n"
+    for w in watches:
+        msg += f"{w['id']}. {w['url']}\n   {w['seen']} recording(s) seen"
+        if w['last_checked']:
+            msg += f", checked {(time.time() - w['last_checked']) / 60:.0f} min ago"
+        msg += f", next in {max(w['next_check'] - time.time(), 0) / 60:.0f} min\n"
+        if w['last_error']:
+            msg += f"   ⚠️ {w['last_error']}\n"
+    return msg
@@ -0,0 +1,104 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from main import TencentMeetingDownloader
+from cookie_pool import CookiePool, sync as sync_cookies
+from progress import ProgressTracker, format_progress
+from broker import get_broker, default_worker_id
+import tracing
+import bandwidth
+import config
+
+# --- LOGGING ---
+logger = logging.getLogger("TencentWorker")
+cookie_pool = CookiePool(config.COOKIE_POOL)
+# Seconds between check-ins that also pick up the front-end's bandwidth limits and cookies
+SYNC_INTERVAL = 10
+
+def _run_job(broker, worker_id, job):
+    """Download one queued job, publishing progress, files and the result back to the front-end."""
+    job_id = job['job_id']
+    tracker = ProgressTracker()
+    stop = threading.Event()
+
+    def publish_progress():
+        # Same coalescing as the in-process path: at most one update per PROGRESS_INTERVAL
+        last_text = None
+        while not stop.wait(config.PROGRESS_INTERVAL):
+            broker.heartbeat(job_id)
+            text = format_progress(tracker.snapshot())
+            if text != last_text:
+                broker.publish(job_id, {'type': 'progress', 'text': text})
+                last_text = text
+
+    reporter = threading.Thread(target=publish_progress, daemon=True)
+    reporter.start()
+    try:
+        priority = bandwidth.BULK if job['download_all'] else bandwidth.INTERACTIVE
+        with tracing.job_trace(job_id), tracing.span("job", url=job['url'], worker=worker_id), \
+                bandwidth.downloads.register(priority) as throttle:
+            downloader = TencentMeetingDownloader(cookie_pool=cookie_pool)
+            downloader.download_all(
+                job['url'],
+                max_count=None if job['download_all'] else 1,
+                progress_callback=tracker,
+                output_dir=config.DOWNLOAD_DIR,
+                quiet=True,
+                throttle=throttle,
+                skip=set(job.get('skip') or []),
+                only=set(job['only']) if job.get('only') is not None else None,
+                on_file=lambda idx, filename, key: broker.publish(
+                    job_id, {'type': 'file', 'idx': idx, 'filename': filename, 'recording': key}
+                ),
+            )
+        broker.publish(job_id, {'type': 'done'})
+    except Exception as e:
+        logger.exception(f"Job {job_id} failed")
+        broker.publish(job_id, {'type': 'failed', 'error': str(e)})
+    finally:
+        stop.set()
+        broker.complete(job, worker_id)
+
+def run():
+    broker = get_broker()
+    if broker is None:
+        print("ERROR: RUN_MODE=WORKER requires QUEUE_BACKEND (sqlite or redis)")
+        return
+
+    worker_id = default_worker_id()
+    broker.recover(worker_id)
+
+    def sync_settings():
+        while True:
+            try:
+                bandwidth.sync(broker, worker_id)
+                sync_cookies(cookie_pool, broker)
+            except Exception:
+                logger.exception("Failed to sync settings with the front-end")
+            time.sleep(SYNC_INTERVAL)
+
+    threading.Thread(target=sync_settings, daemon=True, name="settings-sync").start()
+    slots = threading.Semaphore(config.WORKER_CONCURRENCY)
+    print(f"Worker {worker_id} is starting ({config.WORKER_CONCURRENCY} concurrent jobs)...")
+
+    def run_and_release(job):
+        try:
+            _run_job(broker, worker_id, job)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=config.WORKER_CONCURRENCY) as pool:
+        while True:
+            slots.acquire()
+            try:
+                job = broker.claim(worker_id)
+            except Exception:
+                logger.exception("Failed to claim a job")
+                job = None
+                time.sleep(5)
+            if job is None:
+                slots.release()
+                continue
+            logger.info(f"Claimed job {job['job_id']}: {job['url']}")
+            pool.submit(run_and_release, job)